@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+####################################################
+# Author: Vojtěch Ulej (xulejv00)                  #
+# Created: 18.10. 2026                             #
+# Description: Benchmark of csv parse engines      #
+####################################################
+
+import argparse
+import time
+import numpy as np
+import download
+
+
+# Compares two results of parse_region_data, returns list of indexes of collums which are different
+def different_collums(first, second):
+    diff = []
+    for i, (a, b) in enumerate(zip(first, second)):
+        if a.dtype != b.dtype or a.shape != b.shape:
+            diff.append(i)
+        elif a.dtype.kind == 'M': # NaT is not equal to NaT
+            if not np.all((a == b) | (np.isnat(a) & np.isnat(b))):
+                diff.append(i)
+        elif not np.all(a == b):
+            diff.append(i)
+    return diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare speed of parse engines on one region.')
+    parser.add_argument('--region', type=str, default="PHA")
+    parser.add_argument('--folder', type=str, default="data")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--engines', type=str, nargs='+', default=list(download.parse_engines))
+    parser.add_argument('--offline', action='store_true', help="Don't download data, use files in folder")
+    args = parser.parse_args()
+    results = {}
+    times = {}
+    for engine in args.engines:
+        downloader = download.DataDownloader(folder=args.folder, engine=engine)
+        if args.offline:
+            downloader.data_downloaded = True
+        else:
+            downloader.download_data()
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[engine] = downloader.parse_region_data(args.region, use_cache=False)[1] # Segment cache would be shared by engines
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times[engine] = best
+    base = args.engines[0]
+    print(f"Region {args.region}: {results[base][0].shape[0]} records")
+    print("Engine | time [s] | speedup | same result")
+    for engine in args.engines:
+        diff = different_collums(results[base], results[engine])
+        print(f"{engine} | {times[engine]:.3f} | {times[base] / times[engine]:.1f}x | {'yes' if not diff else diff}")
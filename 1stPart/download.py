@@ -6,17 +6,29 @@
 ####################################################
 
 import requests
-import zipfile
 import pickle
 import os
 import sys
 import csv
 import gzip
 import time
+import shutil
+import itertools
+import re
+import json
+import hashlib
+import threading
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from requests.adapters import HTTPAdapter
 from zipfile import ZipFile
 import numpy as np
-from io import TextIOWrapper
+from io import TextIOWrapper, BytesIO
+try:
+    import pandas as pd
+except ImportError: # pandas is optional, it is used only by parse engine "pandas"
+    pd = None
 
 # Abbreviations of regions assigned to names of csv files
 regions_dict = {
@@ -36,8 +48,11 @@ regions_dict = {
             "VYS" : "16.csv",
 }
 
+# Region collum stores code of region (uint8), code is index of region in this table
+region_names = list(regions_dict)
+
 # Names of each collum in csv files + region collum
-coll_names = ["Region",                                     # viz klíče z regions_dict
+coll_names = ["Region",                                     # kód kraje, viz region_names
               "ID",                                         # p1; identifikační číslo
               "Druh pozemní komunikace",                    # p36
               "Č. pozemní komunikace",                      # p37
@@ -104,16 +119,338 @@ coll_names = ["Region",                                     # viz klíče z regi
               "Lokalita nehody",                            # p5a
               ]
 
+# Short names (codes from csv file description) of collums, collums can be selected by them in get_list
+coll_codes = ["region", "p1", "p36", "p37", "p2a", "weekday(p2a)", "p2b", "p6", "p7", "p8", "p9", "p10", "p11", "p12",
+              "p13a", "p13b", "p13c", "p14", "p15", "p16", "p17", "p18", "p19", "p20", "p21", "p22", "p23", "p24", "p27",
+              "p28", "p34", "p35", "p39", "p44", "p45a", "p47", "p48a", "p49", "p50a", "p50b", "p51", "p52", "p53", "p55a",
+              "p57", "p58", "a", "b", "d", "e", "f", "g", "h", "i", "j", "k", "l", "n", "o", "p", "q", "r", "s", "t", "p5a"]
+
+# Numpy data types of collums in csv files (without region collum)
+csv_types = ([np.uint64, np.int8, np.int32, 'datetime64[D]', np.uint8, np.int16]  # p1, p36, p37, p2a, weekday(p2a), p2b
+             + [np.uint8] * 6 + [np.uint16] * 4                                  # p6 - p11; p12 - p13c
+             + [np.int64]                                                         # p14
+             + [np.uint8] * 24 + [np.uint64] + [np.uint8] * 3                     # p15 - p52; p53; p55a - p58
+             + [object] * 2 + [np.single] * 4                                     # a, b; d - g
+             + [object] * 5 + [np.int32] + [object] * 3 + [np.int32] * 2 + [object]  # h - l; n; o - q; r, s; t
+             + [np.uint8])                                                        # p5a
+date_coll = 3                                                                     # index of p2a in csv file
+float_colls = range(47, 51)                                                       # d, e, f, g
+str_colls = [i for i, t in enumerate(csv_types) if t is object]                   # a, b, h - l, o - q, t
+int_colls = [i for i in range(len(csv_types)) if i != date_coll and i not in float_colls and i not in str_colls]
+bad_values = ['', 'XX']                                                           # known values of number collums which mean missing value
+
+
+# Returns object array in which equal strings are one object (every unique string is stored only once)
+def share_strings(collum):
+    categories, codes = np.unique(collum, return_inverse=True)
+    return categories[codes.reshape(-1)]
+
+
+# Parse engines; every engine takes binary file (csv file from zip) and returns list of collums as numpy arrays
+# Integer collums are int64 (missing or bad values are -1), float collums float64 (-1.0), date collum datetime64[D] (NaT)
+# and string collums are object arrays with shared strings (see share_strings)
+# Final data types are set by cast_collums, so every engine gives the same result
+def parse_csv_python(data):
+    """Parse csv file row by row with csv module (doesn't need any other library)"""
+    rows = []
+    reader = csv.reader(TextIOWrapper(data, encoding = "windows-1250"), delimiter=';')
+    for row in reader:
+        # Check and filter data
+        try:
+            row[3] = np.datetime64(row[3])
+        except ValueError: # Skip whole row (cannot get date)
+            row[3] = np.datetime64('NaT')
+        for i in int_colls: # faster than numpy data type conversion
+            try:
+                row[i] = int(row[i])
+            except ValueError:
+                row[i] = -1
+
+        for i in range(47,51):
+            try:
+                row[i] = float(row[i].replace(',', '.', 1))
+            except ValueError:
+                row[i] = -1.0
+        rows.append(row)
+    np_arr = np.array(rows, dtype=object, order='F').reshape(-1, len(csv_types))
+    collums = []
+    for i, t in enumerate(csv_types):
+        if i == date_coll:
+            collums.append(np.array(np_arr[:, i], dtype='datetime64[D]'))
+        elif i in float_colls:
+            collums.append(np_arr[:, i].astype(np.float64))
+        elif t is object:
+            collums.append(share_strings(np_arr[:, i]))
+        else:
+            collums.append(np_arr[:, i].astype(np.int64))
+    return collums
+
+
+def parse_csv_pandas(data):
+    """Parse csv file by C parser from pandas, types of collums are converted in bulk"""
+    # String collums are read as categories (parser stores every unique string once), other collums are converted by parser
+    # Known bad values (bad_values, eg. XX) are NaN already in parser, so collums stay numeric and don't need slow conversion below
+    df = pd.read_csv(data, sep=';', header=None, encoding='windows-1250', decimal=',', dtype={i: 'category' for i in str_colls},
+                     keep_default_na=False, na_values={i: bad_values for i in range(len(csv_types)) if i not in str_colls}, low_memory=False)
+    collums = []
+    for i in range(len(csv_types)):
+        coll = df[i]
+        if i == date_coll:
+            collums.append(pd.to_datetime(coll, format='%Y-%m-%d', errors='coerce').to_numpy(dtype='datetime64[D]'))
+        elif i in str_colls:
+            collums.append(coll.cat.categories.to_numpy(dtype=object)[coll.cat.codes.to_numpy()])
+        elif i in float_colls:
+            if not pd.api.types.is_numeric_dtype(coll): # Some value is not a number
+                coll = pd.to_numeric(coll.str.replace(',', '.', n=1, regex=False), errors='coerce')
+            collums.append(coll.fillna(-1.0).to_numpy(dtype=np.float64))
+        else:
+            if not pd.api.types.is_numeric_dtype(coll): # Some other value is not a number
+                coll = pd.to_numeric(coll, errors='coerce')
+            if pd.api.types.is_float_dtype(coll): # Decimal numbers are bad values too
+                coll = coll.where(coll % 1 == 0)
+            collums.append(coll.fillna(-1).to_numpy(dtype=np.int64))
+    return collums
+
+
+parse_engines = {
+    "python": parse_csv_python,
+    "pandas": parse_csv_pandas,
+}
+
+
+# Yields parts of csv file (binary file) with at most chunk_rows rows as binary files, which can be parsed by parse engines
+def iter_csv_chunks(data, chunk_rows):
+    lines = (line for line in data if line.strip()) # blank lines are skipped by parse engines
+    while True:
+        chunk = list(itertools.islice(lines, chunk_rows))
+        if not chunk:
+            return
+        yield BytesIO(b''.join(chunk))
+
+
+# Returns IDs (first collum) of records in csv file (binary file) as uint64 array, ID which isn't number is -1 (max uint64)
+def read_ids(data):
+    def parse_id(line):
+        try:
+            return int(line.split(b';', 1)[0].strip().strip(b'"'))
+        except ValueError:
+            return -1
+    return np.fromiter((parse_id(line) for line in data if line.strip()), dtype=np.int64).astype(np.uint64)
+
+
+# Returns boolean mask of records which are kept when duplicate records are removed (same records are kept by merge_region_data)
+# keep="first" keeps first record with every ID, keep="last" keeps last one (records from newer file, if files are sorted by archive_key)
+def unique_mask(ids, keep="first"):
+    if keep not in ("first", "last"):
+        raise ValueError(f"Unknown keep {keep}, use first or last")
+    if pd is not None: # Hash table, IDs are not sorted
+        return ~pd.Series(ids, copy=False).duplicated(keep=keep).to_numpy()
+    ordered = ids if keep == "first" else ids[::-1]
+    _, indexes = np.unique(ordered, return_index=True)
+    mask = np.zeros(ids.shape[0], dtype=bool)
+    mask[indexes] = True
+    return mask if keep == "first" else mask[::-1]
+
+
+# Key for sorting files from oldest to newest (datagis2016.zip, datagis-rok-2017.zip, ..., datagis-09-2020.zip)
+def archive_key(zip_file):
+    year = re.search(r'20\d\d', zip_file)
+    month = re.search(r'-(\d\d)-20\d\d', zip_file)
+    return int(year.group()) if year else 0, int(month.group(1)) if month else 13, zip_file
+
+
+# Converts collums given by parse engine to final data types
+def cast_collums(collums):
+    collums = collums.copy()
+    # Time will be presented as it was given; unknown time will be set to -1
+    collums[5] = np.where(collums[5] > 2500, -1, collums[5])
+    # -1 in unsigned collums is stored as max value of data type (conversion from int64 overflows)
+    return [c if c.dtype == t else c.astype(t) for c, t in zip(collums, csv_types)]
+
+
+# Version of cache format, caches with other version are parsed again
+# (2: region collum stores codes from region_names, 3: collums n, r, s are int32)
+cache_version = 3
+
+
+# Saves collums to directory (columnar cache), every collum is stored in its own uncompressed .npy file
+# so it can be memory-mapped when loaded. String (object) collums are dictionary encoded: codes (.npy) + table of unique strings
+# metadata (dictionary) is stored to schema
+def save_collums(dirname, names, collums, metadata=None):
+    tmp_dirname = dirname + '.tmp'
+    if os.path.exists(tmp_dirname):
+        shutil.rmtree(tmp_dirname)
+    os.makedirs(tmp_dirname)
+    schema = {"version": cache_version, "names": names, "rows": int(collums[0].shape[0]) if collums else 0, "collums": [], **(metadata or {})}
+    for i, coll in enumerate(collums):
+        if coll.dtype == object:
+            categories, codes = np.unique(coll, return_inverse=True)
+            np.save(f"{tmp_dirname}/{i}.codes.npy", codes.astype(np.int32))
+            np.save(f"{tmp_dirname}/{i}.categories.npy", categories, allow_pickle=True)
+            schema["collums"].append({"dtype": "object", "codes": f"{i}.codes.npy", "categories": f"{i}.categories.npy"})
+        else:
+            np.save(f"{tmp_dirname}/{i}.npy", np.ascontiguousarray(coll))
+            schema["collums"].append({"dtype": coll.dtype.str, "file": f"{i}.npy"})
+    with open(tmp_dirname + '/schema.json', 'w') as f:
+        json.dump(schema, f, indent=1)
+    if os.path.exists(dirname): # Replace old cache
+        shutil.rmtree(dirname)
+    os.replace(tmp_dirname, dirname)
+
+
+# Returns schema of collums saved by save_collums, None if there are no collums saved or they are saved in other version of cache format
+def load_schema(dirname):
+    try:
+        with open(dirname + '/schema.json', 'r') as f:
+            schema = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return schema if schema.get("version") == cache_version else None
+
+
+# Loads collums saved by save_collums, collums are memory-mapped (copy on write) so only pages which are used are read from disk
+# If collums (list of indexes) is given, only these collums are loaded and others are None
+# Returns (names, collums)
+def load_collums(dirname, collums=None):
+    with open(dirname + '/schema.json', 'r') as f:
+        schema = json.load(f)
+    loaded = []
+    for i, coll in enumerate(schema["collums"]):
+        if collums is not None and i not in collums:
+            loaded.append(None)
+        elif coll["dtype"] == "object":
+            categories = np.load(f"{dirname}/{coll['categories']}", allow_pickle=True)
+            loaded.append(categories[np.load(f"{dirname}/{coll['codes']}", mmap_mode='r')]) # Strings are shared, not copied for each row
+        else:
+            loaded.append(np.load(f"{dirname}/{coll['file']}", mmap_mode='c'))
+    return schema["names"], loaded
+
+
+# Returns index of collum given by index, code (coll_codes) or name (coll_names)
+def collum_index(collum):
+    if isinstance(collum, (int, np.integer)):
+        if not 0 <= collum < len(coll_codes):
+            raise IndexError(f"Collum index {collum} out of range")
+        return int(collum)
+    if collum in coll_codes:
+        return coll_codes.index(collum)
+    if collum in coll_names:
+        return coll_names.index(collum)
+    raise KeyError(f"Unknown collum {collum}")
+
+
+# Returns boolean mask of rows which fulfil condition
+# Condition is value (collum == value), tuple (low, high) (low <= collum <= high, None means unbounded) or list/set of values
+def condition_mask(collum, condition):
+    def value(v): # Dates can be given as strings
+        return np.datetime64(v) if collum.dtype.kind == 'M' else v
+    if isinstance(condition, tuple):
+        low, high = condition
+        mask = np.ones(collum.shape[0], dtype=bool)
+        if low is not None:
+            mask &= collum >= value(low)
+        if high is not None:
+            mask &= collum <= value(high)
+        return mask
+    if isinstance(condition, (list, set, frozenset)):
+        return np.isin(collum, [value(v) for v in condition])
+    return collum == value(condition)
+
+
+# Returns selected collums (list of indexes, None for every collum) of rows which fulfil every condition from where (dict index: condition)
+def select_collums(collums, selected=None, where=None):
+    mask = None
+    for i, condition in (where or {}).items():
+        m = condition_mask(collums[i], condition)
+        mask = m if mask is None else mask & m
+    if selected is None:
+        selected = range(len(collums))
+    return [collums[i] if mask is None else collums[i][mask] for i in selected]
+
+
+# List of collums returned by get_list
+# region_slices maps every region to slice of its rows, so rows of region can be taken as views (without masks like collum == region)
+class Collums(list):
+    def __init__(self, collums=(), region_slices=None):
+        super().__init__(collums)
+        self.region_slices = region_slices if region_slices is not None else {}
+
+    def region(self, region):
+        """Returns collums of rows from region (views to collums)"""
+        rows = self.region_slices[region]
+        return [c[rows] for c in self]
+
+    def region_codes(self):
+        """Returns codes of regions for every row (same as region collum), it is built from region_slices"""
+        codes = [region_names.index(reg) for reg in self.region_slices]
+        lengths = [rows.stop - rows.start for rows in self.region_slices.values()]
+        return np.repeat(np.array(codes, dtype=np.uint8), lengths)
+
+    def region_categorical(self):
+        """Returns regions of rows as pandas.Categorical (categories are region_names)"""
+        return pd.Categorical.from_codes(self.region_codes(), categories=region_names)
+
+
+# Joins collums of regions (list of tuples (region, collums)) into Collums
+# Every result collum is allocated once (size is known from row counts of regions) and filled by collums of regions
+def join_regions(regions_collums):
+    offsets = np.cumsum([0] + [collums[0].shape[0] if collums else 0 for _, collums in regions_collums])
+    region_slices = {reg: slice(int(start), int(end)) for (reg, _), start, end in zip(regions_collums, offsets[:-1], offsets[1:])}
+    if len(regions_collums) == 1: # Nothing to join, collums are not copied
+        return Collums(regions_collums[0][1], region_slices)
+    result = Collums(region_slices=region_slices)
+    for parts in zip(*(collums for _, collums in regions_collums)):
+        joined = np.empty(offsets[-1], dtype=np.result_type(*parts))
+        for part, start, end in zip(parts, offsets[:-1], offsets[1:]):
+            joined[start:end] = part
+        result.append(joined)
+    return result
+
+
+# Parses region and saves it to cache file, this function is run in worker processes by get_list
+# Returns parsed region and report of duplicate records (see merge_region_data)
+def parse_and_cache_region(downloader, region):
+    parsed = downloader.parse_region_data(region)
+    downloader.save_region_cache(region, parsed)
+    return parsed, downloader.duplicates.get(region)
+
+
 # Class download and process data or loads them from cache
 class DataDownloader:
 
-    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/", folder="data", cache_filename="data_{}.pkl.gz"):
+    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/", folder="data", cache_filename=None, manifest_filename="manifest.json", engine=None, cache_format="npy", keep_duplicate="first", sort_by_id=True):
         self.url = url
         self.headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:20.0) Gecko/20100101 Firefox/20.0'}
+        self.timeout = (10, 60) # Timeout of connection and of waiting for data (s), stalled download doesn't block worker forever
         self.folder = folder
         if not os.path.exists(folder):
             os.makedirs(folder)
+        # Cache format "npy" stores every region as directory of memory-mappable collums (see save_collums), "pickle" as gzipped pickle
+        if cache_format not in ("npy", "pickle"):
+            raise ValueError(f"Unknown cache format {cache_format}, use npy or pickle")
+        self.cache_format = cache_format
+        if cache_filename is None:
+            cache_filename = "data_{}" if cache_format == "npy" else "data_{}.pkl.gz"
         self.cache_filename = cache_filename
+        # Parse engine from parse_engines used for csv files, engine "pandas" is much faster but it needs pandas
+        if engine is None:
+            engine = "pandas" if pd is not None else "python"
+        if engine not in parse_engines:
+            raise ValueError(f"Unknown parse engine {engine}, use one of: {', '.join(parse_engines)}")
+        self.engine = engine
+        # Records with same ID from several files: keep_duplicate="first" keeps record from oldest file, "last" from newest file (corrected record)
+        # sort_by_id: records of region are sorted by ID, otherwise they stay in order of files (and order in files)
+        if keep_duplicate not in ("first", "last"):
+            raise ValueError(f"Unknown keep_duplicate {keep_duplicate}, use first or last")
+        self.keep_duplicate = keep_duplicate
+        self.sort_by_id = sort_by_id
+        self.duplicates = {} # Report of removed duplicate records for every parsed region (see merge_region_data)
+        self.session = None # Pooled http session shared by all downloads (created by self.get_session)
+        # Manifest stores validators (ETag, Last-Modified) of index page and size + checksum of every downloaded archive
+        # so next runs can send conditional requests instead of downloading everything again
+        self.manifest_filename = manifest_filename
+        self.manifest = self.load_manifest()
+        self.manifest_lock = threading.Lock()
         self.parsed_region = None # This attribute store last region parsed
         # self.data_downloaded
         # If data were already downloaded it wouldn't download them again (This is for performance enhancement)
@@ -123,146 +460,387 @@ class DataDownloader:
         # Those file names are hardcoded, because I don't expect that file names for older years would be changed
         # If those filenames would change these values needs to be changed as-well
         self.files_to_process = set(["datagis2016.zip", "datagis-rok-2017.zip", "datagis-rok-2018.zip", "datagis-rok-2019.zip"])
+        if "links" in self.manifest["index"]: # Latest file for 2020 is known from last download
+            self.choose_files_to_download([x[5:] for x in self.manifest["index"]["links"]])
+        # Caches are keyed by checksums of files (see archive_hashes), checksums of files which aren't in manifest are computed once
+        self.computed_hashes = {}
+        # Parsed data of every region from every file are cached in this directory (as segments), so only new files are parsed
+        self.segments_folder = self.folder + '/segments'
+
+    # Session and lock can't be sent to worker processes (see get_list), worker creates its own
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["session"] = None
+        state["manifest_lock"] = None
+        state["parsed_region"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.manifest_lock = threading.Lock()
+
+    # Returns session shared by all requests, connections are kept alive and reused between files
+    def get_session(self, pool_size=10):
+        if self.session is None:
+            self.session = requests.session()
+            self.session.cookies = requests.cookies.RequestsCookieJar()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        return self.session
+
+    # Loads manifest from self.folder, returns empty manifest if there is none (or it is damaged)
+    def load_manifest(self):
+        try:
+            with open(self.folder + '/' + self.manifest_filename, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.setdefault("index", {})
+        manifest.setdefault("files", {})
+        return manifest
+
+    def save_manifest(self):
+        with self.manifest_lock:
+            tmp_fname = self.folder + '/' + self.manifest_filename + '.tmp'
+            with open(tmp_fname, 'w') as f:
+                json.dump(self.manifest, f, indent=1)
+            os.replace(tmp_fname, self.folder + '/' + self.manifest_filename)
+
+    # Returns headers for conditional request from manifest entry (empty dict if entry has no validators)
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry.get("etag"):
+            headers['If-None-Match'] = entry["etag"]
+        if entry.get("last_modified"):
+            headers['If-Modified-Since'] = entry["last_modified"]
+        return headers
 
     # Downloads data
-    def download_data(self):
-        """Downloads data from url to folder"""
+    def download_data(self, workers=4):
+        """Downloads data from url to folder, at most `workers` files are downloaded concurrently"""
         if not os.path.exists(self.folder):
             os.makedirs(self.folder)
-        s = requests.session()
-        jar = requests.cookies.RequestsCookieJar()
-        s.cookies = jar
-        resp = s.get(self.url, headers=self.headers)
-        soup = BeautifulSoup(resp.content, 'html.parser')
-        download_links = [x['href'] for x in soup.find_all('a', class_= "btn btn-sm btn-primary")] # links to zip files from url
+        workers = max(1, workers)
+        s = self.get_session(pool_size=max(10, workers))
+        index = self.manifest["index"]
+        resp = s.get(self.url, headers={**self.headers, **self.conditional_headers(index)}, timeout=self.timeout)
+        if resp.status_code == 304 and "links" in index: # Index page did not change, use links from manifest
+            download_links = index["links"]
+        else:
+            resp.raise_for_status()
+            soup = BeautifulSoup(resp.content, 'html.parser')
+            download_links = [x['href'] for x in soup.find_all('a', class_= "btn btn-sm btn-primary")] # links to zip files from url
+            self.manifest["index"] = {"etag": resp.headers.get('ETag'), "last_modified": resp.headers.get('Last-Modified'), "links": download_links}
+        processed = set(self.files_to_process)
         self.choose_files_to_download([x[5:] for x in download_links])
-        for link in download_links: # Donwload only latest files (for years 2016-2019 are hardcoded to self.files_to_process, 2020 is choosed by function self.choose_files_to_download)
-            if link[5:] in self.files_to_process: # skip files that are not needed
+        if processed != self.files_to_process: # Newer file is available, parsed region is not up to date
+            self.parsed_region = None
+        # Donwload only latest files (for years 2016-2019 are hardcoded to self.files_to_process, 2020 is choosed by function self.choose_files_to_download)
+        links = [link for link in download_links if link[5:] in self.files_to_process] # skip files that are not needed
+        if workers == 1:
+            for link in links:
                 self.download_file(link)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(self.download_file, links): # Iterating results re-raises exceptions from workers
+                    pass
+        self.save_manifest()
         self.data_downloaded = True
 
     # TODO Works only till year 2020 files for 2021 would not automaticaly added to files_to_proccess
-    # Choose latest file for year 2020
+    # Choose latest file for year 2020 (file chosen before is replaced)
     def choose_files_to_download(self, files_names):
         files_20 = [f for f in files_names if "2020" in f]
+        if not files_20:
+            return
+        self.files_to_process -= set(f for f in self.files_to_process if "2020" in f)
         for file in files_20:
             if 'rok' in file:
-                self.files_to_process.append(file)
+                self.files_to_process.add(file)
                 return
         files_20.sort(reverse=True,key=lambda x:int(x[8:10]))
         self.files_to_process.add(files_20[0])
 
+    # Returns dictionary file name: sha256 checksum for every processed file (None if file isn't downloaded), files are sorted from oldest
+    # Checksum is taken from manifest, if it isn't there it is computed
+    def archive_hashes(self):
+        hashes = {}
+        for zip_file in sorted(self.files_to_process, key=archive_key): # from oldest to newest
+            fname = self.folder + '/' + zip_file
+            if not os.path.exists(fname):
+                hashes[zip_file] = None
+                continue
+            entry = self.manifest["files"].get(zip_file, {})
+            if entry.get("sha256") and entry.get("size") == os.path.getsize(fname):
+                hashes[zip_file] = entry["sha256"]
+                continue
+            key = (zip_file, os.path.getsize(fname), os.path.getmtime(fname))
+            if key not in self.computed_hashes:
+                checksum = hashlib.sha256()
+                with open(fname, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1048576), b''):
+                        checksum.update(chunk)
+                self.computed_hashes[key] = checksum.hexdigest()
+            hashes[zip_file] = self.computed_hashes[key]
+        return hashes
+
+    # Region cache is valid only for same files and same way of removing duplicates
+    def cache_key(self):
+        return {"archives": self.archive_hashes(), "keep_duplicate": self.keep_duplicate, "sort_by_id": self.sort_by_id}
+
+    # Returns directory of cached collums of region parsed from file with checksum
+    def segment_dirname(self, zip_file, checksum, region):
+        return f"{self.segments_folder}/{zip_file}.{checksum[:16]}.{region}"
+
     # Downloads one file from url + file_url_path if file is not already downloaded
-    # if you suspect that some file is damaged (or has been changed on server) delete it yourself and run download again
+    # File is written to temporary file (name + '.part') which is renamed when download is complete,
+    # so file in self.folder is always complete. If temporary file exists (previous run was killed) download is resumed by Range request,
+    # but only if its validators (ETag/Last-Modified) are known and sent as If-Range, otherwise it is downloaded again from the beginning.
+    # Already downloaded file is revalidated by conditional request (ETag/Last-Modified from manifest), so changed file on server is downloaded again.
     def download_file(self, file_url_path):
-        s = requests.session()
-        jar = requests.cookies.RequestsCookieJar()
-        s.cookies = jar
-        with s.get(self.url + file_url_path, headers=self.headers, stream = True) as resp:
-            if not os.path.exists(self.folder + '/' + file_url_path.split('/')[-1]): # Checking if file is already downloaded
-                with open(self.folder + '/' + file_url_path.split('/')[-1],'wb') as f:
-                    for chunk in resp.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
+        name = file_url_path.split('/')[-1]
+        fname = self.folder + '/' + name
+        part_fname = fname + '.part'
+        entry = self.manifest["files"].get(name, {})
+        old_checksum = entry.get("sha256") if os.path.exists(fname) else None
+        headers = dict(self.headers)
+        offset = 0
+        if os.path.exists(fname):
+            if entry.get("size") == os.path.getsize(fname):
+                headers.update(self.conditional_headers(entry))
+            # File not in manifest (or with different size) is downloaded again, it can be damaged
+        elif os.path.exists(part_fname) and entry.get("size") is None and (entry.get("etag") or entry.get("last_modified")):
+            offset = os.path.getsize(part_fname)
+        # Without validators server can't check that file was not changed, so parts of two versions of file could be joined
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = entry.get("etag") or entry.get("last_modified") # Server sends whole file if it was changed
+        with self.get_session().get(self.url + file_url_path, headers=headers, stream=True, timeout=self.timeout) as resp:
+            if resp.status_code == 304: # Not modified
+                return
+            if resp.status_code == 416: # Range not satisfiable, temporary file is not usable
+                os.remove(part_fname)
+                return self.download_file(file_url_path)
+            resp.raise_for_status()
+            checksum = hashlib.sha256()
+            if resp.status_code == 206:
+                entry = {**entry, "etag": resp.headers.get('ETag', entry.get("etag")), "last_modified": resp.headers.get('Last-Modified', entry.get("last_modified"))}
+                with open(part_fname, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1048576), b''):
+                        checksum.update(chunk)
+            else: # Server may ignore Range header and send whole file (status 200)
+                entry = {"etag": resp.headers.get('ETag'), "last_modified": resp.headers.get('Last-Modified'), "size": None}
+                with self.manifest_lock:
+                    self.manifest["files"][name] = entry
+                self.save_manifest() # Validators of temporary file are needed for resuming
+            with open(part_fname, 'ab' if resp.status_code == 206 else 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=65536):
+                    if chunk:
+                        f.write(chunk)
+                        checksum.update(chunk)
+        entry = {**entry, "size": os.path.getsize(part_fname), "sha256": checksum.hexdigest()}
+        if old_checksum == entry["sha256"]: # Content matches manifest, file is kept
+            os.remove(part_fname)
+        else:
+            os.replace(part_fname, fname)
+        with self.manifest_lock:
+            self.manifest["files"][name] = entry
+        self.save_manifest()
 
     # Parse region data, if datas are not downloaded, it downloads them
-    # Note that this function doesn't read data from cache or self.parsed_region, neither it caches data
-    def parse_region_data(self, region):
-        if not self.data_downloaded:
-            self.download_data()
+    # Note that this function doesn't read region cache or self.parsed_region, neither it caches whole region,
+    # but it reads and writes cached segments of every file (see parse_regions_data) unless use_cache is False
+    def parse_region_data(self, region, use_cache=True):
         if not region in regions_dict:          # Check if region is valid
             print(f"Region {region} not known!", file=sys.stderr)
             return
+        return self.parse_regions_data([region], use_cache)[region]
 
-        csv_fname = regions_dict[region]        # csv file name from dictionary
-        zip_files = [zip_file for zip_file in os.listdir(self.folder) if zipfile.is_zipfile(self.folder + '/' + zip_file)]  # filter non zip files from dir
-        rows = [] # filtered rows from all files
-        for zip_file in self.files_to_process: # procces data from every file downloaded
-            with ZipFile( self.folder + '/' + zip_file, 'r') as zip:
-                if not csv_fname in zip.namelist(): # csv file missing
-                    continue
-                with zip.open(csv_fname, 'r') as data:
-                    reader = csv.reader(TextIOWrapper(data, encoding = "windows-1250"), delimiter=';')
-                    for row in reader:
-                        # Check and filter data
-                        try:
-                            row[3] = np.datetime64(row[3])
-                        except ValueError: # Skip whole row (cannot get date)
-                            row[3] = np.datetime64('NaT')
-                        for r in [range(0,3), range(4,45), [len(row)-1]]: # faster than numpy data type conversion
-                            for i in r:
-                                try:
-                                    row[i] = int(row[i])
-                                except ValueError:
-                                    row[i] = -1
-
-                        for i in range(47,51):
-                            try:
-                                row[i] = float(row[i].replace(',', '.', 1))
-                            except ValueError:
-                                row[i] = -1.0
-                        rows.append(row)
-        np_arr = np.array(rows, order='F') # not unique
-        _,indexes = np.unique(np_arr[:,0], return_index=True) # remove duplicate ids from array (ids are unique for every accident)
-        np_arr = np_arr[indexes] # array filtered for missing/bad values and duplicates
-        #for i in range(0,np_arr.shape[1]): # This was slower
-        #    np_arr[:, i][np_arr[:, i] == ''] = '-1' # Change missing value to int string representation will be representet as max for uint
-        list = [np.full(fill_value=region,shape=np_arr.shape[0])] # Create collum full of region name
-        # Create numpy arrays for each collum
-        list.append(np.array(np_arr[:, 0], dtype=np.uint64, order='C'))
-        list.append(np.array(np_arr[:, 1], dtype=np.int8, order='C'))
-        list.append(np.array(np_arr[:, 2], dtype=np.int32, order='C'))
-        list.append(np.array(np_arr[:, 3], dtype=np.datetime64, order='C'))
-        list.append(np.array(np_arr[:, 4], dtype=np.uint8, order='C'))
-        # Time will be presented as it was given; unknown time will be set to -1
-        np_arr[:, 5][np_arr[:, 5] > 2500] = -1
-        list.append(np.array(np_arr[:, 5], dtype=np.int16, order='C'))
-        for i in range(6,16):
-            if i in range(12,16): # p12 - p13c uint16
-                list.append(np.array(np_arr[:, i], dtype=np.uint16, order='C'))
-            else:       # p6 - p11 uint8
-                list.append(np.array(np_arr[:, i], dtype=np.uint8, order='C'))
-        list.append(np.array(np_arr[:, 16], dtype=np.int64, order='C')) # Hmotná škoda p14
-        #np_arr[:, 34][np_arr[:, 34] == 'XX'] = '-1'
-        for i in range(17,41): # p15 - p45a - p
-            list.append(np.array(np_arr[:, i], dtype=np.uint8, order='C'))
-        list.append(np.array(np_arr[:, 41], dtype=np.uint64, order='C')) # Škoda na vozidle p53
-        for i in range(42,45): # p55a - p58
-            list.append(np.array(np_arr[:, i], dtype=np.uint8, order='C'))
-        list.append(np.array(np_arr[:, 45], order='C')) # a
-        list.append(np.array(np_arr[:, 46], order='C')) # b
-        for i in range(47,51):
-            list.append(np.array(np_arr[:, i], dtype=np.single, order='C')) # d GPS X; e GPS Y; f and g some float
-        for i in range(51,63): # h - t store as string; its usually blank
-            list.append(np.array(np_arr[:, i], order='C'))
-        list.append(np.array(np_arr[:, 63], dtype=np.uint8, order='C'))
+    # Parse data of several regions in one pass over downloaded files, every zip file is opened only once
+    # Collums of every region from every file are cached as segments, file is opened only if some of its segments are not cached
+    # (eg. only new file for 2020 is parsed when it is downloaded)
+    # If use_cache is False, every file is parsed by self.engine and segments are neither read nor written (eg. for benchmark of engines)
+    # Returns dictionary region: result of parse_region_data (unknown regions are skipped)
+    def parse_regions_data(self, regions, use_cache=True):
+        if not self.data_downloaded:
+            self.download_data()
+        regions = [reg for reg in regions if reg in regions_dict]
+        parse_csv = parse_engines[self.engine]
+        archives = self.archive_hashes()
+        files_collums = {reg: [] for reg in regions} # (file name, collums) parsed from every file for each region
+        for zip_file, checksum in archives.items(): # procces data from every file downloaded
+            if checksum is None: # file is not downloaded (it isn't on server)
+                print(f"File {zip_file} not found!", file=sys.stderr)
+                continue
+            to_parse = []
+            for reg in regions:
+                segment = self.segment_dirname(zip_file, checksum, reg)
+                if use_cache and load_schema(segment) is not None:
+                    files_collums[reg].append((zip_file, load_collums(segment)[1]))
+                else:
+                    to_parse.append(reg)
+            if not to_parse:
+                continue
+            with ZipFile( self.folder + '/' + zip_file, 'r') as archive:
+                members = set(archive.namelist())
+                for reg in to_parse:
+                    csv_fname = regions_dict[reg]        # csv file name from dictionary
+                    if not csv_fname in members: # csv file missing, empty segment is cached
+                        collums = [np.empty(0, dtype=t) for t in csv_types]
+                    else:
+                        with archive.open(csv_fname, 'r') as data:
+                            collums = cast_collums(parse_csv(data))
+                    if use_cache:
+                        save_collums(self.segment_dirname(zip_file, checksum, reg), coll_names[1:], collums)
+                    files_collums[reg].append((zip_file, collums))
+        if not use_cache:
+            return {reg: self.merge_region_data(reg, files_collums[reg]) for reg in regions}
+        # Segments of files which are not processed anymore (replaced by newer version) are removed
+        segments = set(self.segment_dirname(zip_file, checksum, reg) for zip_file, checksum in archives.items() if checksum for reg in regions)
+        for name in (os.listdir(self.segments_folder) if os.path.isdir(self.segments_folder) else []):
+            segment = self.segments_folder + '/' + name
+            if name.rsplit('.', 1)[-1] in regions and segment not in segments:
+                shutil.rmtree(segment, ignore_errors=True)
+        return {reg: self.merge_region_data(reg, files_collums[reg]) for reg in regions}
+
+    # Merges collums parsed from files (list of tuples (file name, collums)) for one region, removes duplicate records and adds region collum
+    # Records with same ID are removed by self.keep_duplicate on typed ID collum; numbers of removed records are stored
+    # to self.duplicates[region] as dictionary (file with kept record, file with removed record): count
+    def merge_region_data(self, region, files_collums):
+        collums = [np.concatenate(c) for c in zip(*(c for _, c in files_collums))] # not unique
+        ids = collums[0]
+        kept = unique_mask(ids, self.keep_duplicate) # remove duplicate ids from array (ids are unique for every accident)
+        indexes = np.flatnonzero(kept)
+        if self.sort_by_id:
+            indexes = indexes[np.argsort(ids[indexes], kind='stable')]
+        # Report of duplicates, file of every record is found by its index
+        files = np.repeat(np.arange(len(files_collums)), [c[0].shape[0] for _, c in files_collums])
+        sorted_kept = indexes if self.sort_by_id else indexes[np.argsort(ids[indexes], kind='stable')]
+        removed = np.flatnonzero(~kept)
+        kept_files = files[sorted_kept[np.searchsorted(ids[sorted_kept], ids[removed])]]
+        pairs, counts = np.unique(kept_files * len(files_collums) + files[removed], return_counts=True)
+        self.duplicates[region] = {(files_collums[p // len(files_collums)][0], files_collums[p % len(files_collums)][0]): int(c) for p, c in zip(pairs, counts)}
+        list = [np.full(fill_value=region_names.index(region),shape=indexes.shape[0],dtype=np.uint8)] # Create collum full of region code
+        list.extend(c[indexes] for c in collums) # collums filtered for duplicates
         return coll_names.copy(), list.copy()
 
-    def get_list(self, regions = None):
-        parsed_regions = []
+    # Loads region from cache file, returns None if region is not cached
+    # Only collums (list of indexes) are loaded from columnar cache, if they are given
+    # Cache is used only if it was created from same files (checksums) which should be processed now
+    def load_region_cache(self, region, collums=None):
+        out_fname = self.folder + '/' + self.cache_filename.format(region)
+        if self.cache_format == "npy":
+            schema = load_schema(out_fname)
+            if schema is None or schema.get("key") != self.cache_key(): # Cache in old format or from other files
+                return None
+            return load_collums(out_fname, collums)
+        if not os.path.exists(out_fname):
+            return None
+        with gzip.open(out_fname, 'rb') as pkl:
+            parsed = pickle.load(pkl)
+        if len(parsed) != 3 or parsed[2] != self.cache_key(): # Cache in old format (without checksums) or from other files
+            return None
+        return parsed[0], parsed[1]
+
+    def save_region_cache(self, region, parsed):
+        out_fname = self.folder + '/' + self.cache_filename.format(region)
+        if self.cache_format == "npy":
+            save_collums(out_fname, *parsed, metadata={"key": self.cache_key()})
+            return
+        with gzip.open(out_fname, 'wb') as of:
+            pickle.dump((*parsed, self.cache_key()), of)
+
+    # Returns data for regions (every region if regions is None)
+    # Regions which are not cached are parsed in `workers` processes, every worker saves its region to cache
+    # columns: list of collums (index, code from coll_codes or name) which are returned, other collums aren't loaded from cache (None = every collum)
+    # where: dictionary collum: condition (see condition_mask), only rows which fulfil every condition are returned
+    #   eg. where={"p2a": ("2019-01-01", "2019-12-31"), "p44": (3, 7), "p5a": 1}
+    def get_list(self, regions = None, workers = 1, columns = None, where = None):
+        parsed_regions = {}
         if regions is None: # process every region
             regions = regions_dict.keys()
+        regions = list(regions)
+        selected = None if columns is None else [collum_index(c) for c in columns]
+        where = {collum_index(c): condition for c, condition in (where or {}).items()}
+        needed = None if selected is None else set(selected) | set(where) # collums which have to be loaded
+        to_parse = [] # regions which aren't cached
         for reg in regions:
-            out_fname = self.cache_filename.format(reg)
             if self.parsed_region is not None:  # check if region is stored in attribute
-                if np.all(self.parsed_region[1][0] == reg):  # Check if region is parsed and cached
-                    parsed_regions.append(self.parsed_region[1])
+                if reg in regions_dict and np.all(self.parsed_region[1][0] == region_names.index(reg)):  # Check if region is parsed and cached
+                    parsed_regions[reg] = self.parsed_region[1]
                     continue
-            if os.path.exists(self.folder + '/' + out_fname): # Check if region is parsed and cached in file
-                with gzip.open(self.folder + '/' + out_fname,'rb') as pkl:
-                    self.parsed_region = pickle.load(pkl)
-                    parsed_regions.append(self.parsed_region[1])
+            cached = self.load_region_cache(reg, needed) # Check if region is parsed and cached in file
+            if cached is not None:
+                if needed is None: # Only whole region is stored
+                    self.parsed_region = cached
+                parsed_regions[reg] = cached[1]
+                continue
+            if reg in regions_dict: # Unknown regions are skipped by both parallel and serial parsing
+                to_parse.append(reg)
+        if workers > 1 and len(to_parse) > 1:
+            if not self.data_downloaded: # Download data once, before workers are started
+                self.download_data()
+            with ProcessPoolExecutor(max_workers=min(workers, len(to_parse))) as executor:
+                for reg, (parsed, duplicates) in zip(to_parse, executor.map(partial(parse_and_cache_region, self), to_parse)):
+                    self.duplicates[reg] = duplicates
+                    self.parsed_region = parsed
+                    parsed_regions[reg] = self.parsed_region[1]
+        elif to_parse:
+            for reg, parsed in self.parse_regions_data(to_parse).items(): # All regions are parsed in one pass over files
+                self.save_region_cache(reg, parsed)
+                self.parsed_region = parsed
+                parsed_regions[reg] = self.parsed_region[1]
+        # Filter rows and collums before regions are joined, unknown regions are skipped
+        result = join_regions([(reg, select_collums(parsed_regions[reg], selected, where)) for reg in regions if reg in parsed_regions])
+        names = coll_names.copy() if selected is None else [coll_names[i] for i in selected]
+        return names, result
+
+
+    # Yields data of regions in chunks (names, Collums) with at most chunk_rows records, so only one chunk is in memory
+    # Chunk has same collums as result of get_list (columns and where are same as in get_list) and contains records of one region
+    # Records are in order of files (get_list sorts records of region by ID, if sort_by_id is set)
+    # Duplicate records are removed as in get_list: IDs from every file are read first (8 B per record), than records are parsed and yielded
+    def iter_chunks(self, regions = None, chunk_rows = 100000, columns = None, where = None):
+        if not self.data_downloaded:
+            self.download_data()
+        if regions is None: # process every region
+            regions = regions_dict.keys()
+        selected = None if columns is None else [collum_index(c) for c in columns]
+        where = {collum_index(c): condition for c, condition in (where or {}).items()}
+        names = coll_names.copy() if selected is None else [coll_names[i] for i in selected]
+        parse_csv = parse_engines[self.engine]
+        archives = [zip_file for zip_file, checksum in self.archive_hashes().items() if checksum is not None]
+        for reg in regions:
+            if not reg in regions_dict:          # Check if region is valid
+                print(f"Region {reg} not known!", file=sys.stderr)
+                continue
+            csv_fname = regions_dict[reg]
+            ids = [] # First pass, IDs of records in every file
+            for zip_file in archives:
+                with ZipFile( self.folder + '/' + zip_file, 'r') as archive:
+                    if not csv_fname in archive.namelist():
+                        ids.append(np.empty(0, dtype=np.uint64))
+                        continue
+                    with archive.open(csv_fname, 'r') as data:
+                        ids.append(read_ids(data))
+            keep = unique_mask(np.concatenate(ids), self.keep_duplicate)
+            offset = 0
+            for zip_file, file_ids in zip(archives, ids): # Second pass, records are parsed by chunks
+                if file_ids.shape[0] == 0:
                     continue
-            self.parsed_region = self.parse_region_data(reg)
-            with gzip.open(self.folder + '/' + out_fname,'wb') as of: # Save result to cache
-                pickle.dump(self.parsed_region,of)
-            parsed_regions.append(self.parsed_region[1])
-        it = iter(parsed_regions)
-        result = next(it) # final numpy array declaration
-        for arrays in it:
-            for i, a in enumerate(result):
-                result[i] = np.concatenate((a,arrays[i]))
-        return coll_names.copy(), result.copy()
+                with ZipFile( self.folder + '/' + zip_file, 'r') as archive:
+                    with archive.open(csv_fname, 'r') as data:
+                        for chunk in iter_csv_chunks(data, chunk_rows):
+                            collums = cast_collums(parse_csv(chunk))
+                            mask = keep[offset:offset + collums[0].shape[0]]
+                            offset += collums[0].shape[0]
+                            collums = [np.full(np.count_nonzero(mask), region_names.index(reg), dtype=np.uint8)] + [c[mask] for c in collums]
+                            collums = select_collums(collums, selected, where)
+                            rows = collums[0].shape[0] if collums else 0
+                            if rows:
+                                yield names, Collums(collums, {reg: slice(0, rows)})
 
 
 if __name__ == "__main__":
@@ -275,7 +853,8 @@ if __name__ == "__main__":
         print(c, end=" | ")
     print("\n\nKraj | počet záznamů" )
     for reg in regions:
-        print(reg, " |", np.count_nonzero(data[1][0] == reg))
+        rows = data[1].region_slices[reg]
+        print(reg, " |", rows.stop - rows.start)
     print("\nCelkem záznamů:",data[1][0].shape[0])
 
 
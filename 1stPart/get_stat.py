@@ -13,28 +13,46 @@ import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 
+# Counts accidents in data (result of DataDownloader.get_list) grouped by keys from by ("region", "year")
+# Returns (labels, counts): labels is tuple with array of values for every key (region names, years),
+# counts is array with shape (len(labels[0]), len(labels[1]), ...); accidents without date aren't counted by year
+# Every group is counted by single np.bincount over combined integer codes of keys
+def accident_counts(data, by=("region", "year")):
+    names, collums = data
+    valid = None
+    codes = []
+    labels = []
+    for key in by:
+        if key == "region":
+            regs = np.asarray(collums[names.index(download.coll_names[0])]).astype(np.intp)
+            codes.append(regs)
+            labels.append(np.array(download.region_names))
+        elif key == "year":
+            dates = np.asarray(collums[names.index(download.coll_names[4])])
+            known = ~np.isnat(dates)
+            years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+            first, last = (years[known].min(), years[known].max()) if known.any() else (0, -1)
+            codes.append(np.where(known, years - first, 0))
+            labels.append(np.arange(first, last + 1))
+            valid = known if valid is None else valid & known
+        else:
+            raise ValueError(f"Unknown key {key}, use region or year")
+    shape = tuple(len(l) for l in labels)
+    flat = np.ravel_multi_index(tuple(c if valid is None else c[valid] for c in codes), shape)
+    counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+    for axis in range(len(by)): # Only regions and years which are in data
+        present = counts.sum(axis=tuple(i for i in range(len(by)) if i != axis)) > 0
+        labels[axis] = labels[axis][present]
+        counts = np.compress(present, counts, axis=axis)
+    return tuple(labels), counts
+
+
 # Function takes data from data_source and plots them
 def plot_stat(data_source, fig_location=None, show_figure=False):
-    regs = data_source[1][0]  # np.array of regions
-    dates = data_source[1][4] # np.array of dates
-    regions = np.unique(regs) # array of unique regions
-    years = set() # All years from dataset
-    for d in dates:
-        years.add(d.astype(object).year)
-    years = sorted(years)
-    accidents_by_reg_year = [] # Accidents in region and year (list of tupple(region, year, accidents_count))
-    for r in regions:
-        accidents_dates_by_reg = dates[regs == r]   # Accidents dates in region r
-        for i in range(len(years)):
-            if i != len(years) - 1:
-                # Count of accidents in year years[i]
-                # This is calculated ass accidents till year years[i] - accidents till year years[i+1]
-                # eg. Accident for year >= 2016 - year >= 2017
-                count = np.count_nonzero(accidents_dates_by_reg >= np.datetime64(str(years[i]))) - np.count_nonzero(
-                    accidents_dates_by_reg >= np.datetime64(str(years[i + 1])))
-            else:  # last year
-                count = np.count_nonzero(accidents_dates_by_reg >= np.datetime64(str(years[i])))
-            accidents_by_reg_year.append((r, years[i], count))
+    # Collums are found by name, so data_source can contain only some collums (see get_list(columns=...))
+    (regions, years), counts = accident_counts(data_source, by=("region", "year"))
+    order = np.argsort(regions) # regions in alphabetical order
+    accidents_by_reg_year = [(regions[r], int(years[y]), int(counts[r, y])) for r in order for y in range(len(years))] # Accidents in region and year (list of tupple(region, year, accidents_count))
     # Sort accidents by year and count (reverse) so first is region with highest count of accidents in highest year (2020)
     accidents_by_reg_year.sort(key=lambda x: x[2], reverse=True)  # Sort by count
     accidents_by_reg_year.sort(key=lambda x: x[1], reverse=True)  # Sort by year
@@ -89,6 +107,8 @@ if __name__ == "__main__":
     fig_location = args.fig_location
     # Example how to run function:
     # plot_stat(DataDownloader().get_list(),show_figure=True,fig_location='data/plot.png')
+    # plot_stat needs only regions and dates, other collums don't have to be loaded:
+    # plot_stat(DataDownloader().get_list(columns=["region", "p2a"]),show_figure=True,fig_location='data/plot.png')
     # Running interactive console so user can run function
     code.interact(local=locals())
 
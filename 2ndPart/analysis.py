@@ -7,8 +7,12 @@ import pandas as pd
 import seaborn as sns
 import numpy as np
 import os
+import sys
 from sys import stderr
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from accidents import load_dataframe, memory_usage
+
 # muzete pridat libovolnou zakladni knihovnu ci knihovnu predstavenou na prednaskach
 # dalsi knihovny pak na dotaz
 
@@ -18,119 +22,56 @@ def eprint(*args, **kwargs):
     print(*args, file=stderr, **kwargs)
 
 
-column_types = {
-    "p1": 'int64',
-    "p36": 'int8',
-    #"p37": 'int32',
-    "p2a": 'datetime64',
-    "weekday(p2a)": 'int8',
-    "p2b": 'int16',
-    "p6": 'int8',
-    "p7": 'int8',
-    "p8": 'int8',
-    "p9": 'int8',
-    "p10": 'int8',
-    "p11": 'int8',
-    "p12": 'int16',
-    "p13a": 'int16',
-    "p13b": 'int16',
-    "p13c": 'int16',
-    "p14": 'int64',
-    "p15": 'int8',
-    "p16": 'int8',
-    "p17": 'int8',
-    "p18": 'int8',
-    "p19": 'int8',
-    "p20": 'int8',
-    "p21": 'int8',
-    "p22": 'int8',
-    "p23": 'int8',
-    "p24": 'int8',
-    "p27": 'int8',
-    "p28": 'int8',
-    "p34": 'int8',
-    "p35": 'int8',
-    "p39": 'int8',
-    "p44": 'int8',
-    "p45a": 'int8',
-    "p47": 'int8',
-    "p48a": 'int8',
-    "p49": 'int8',
-    "p50a": 'int8',
-    "p50b": 'int8',
-    "p51": 'int8',
-    "p52": 'int8',
-    "p53": 'int64',
-    "p55a": 'int8',
-    "p57": 'int8',
-    "p58": 'int8',
-    "a": 'str',
-    "b": 'str',
-    "d": 'float64',
-    "e": 'float64',
-    "f": 'float64',
-    "g": 'float64',
-    "h": 'str',
-    "i": 'str',
-    "j": 'str',
-    "k": 'str',
-    "l": 'str',
-    "n": 'str',
-    "o": 'str',
-    "p": 'str',
-    "q": 'str',
-    "r": 'str',
-    "s": 'str',
-    "t": 'str',
-    "p5a": 'int8'
-}
-
-
 # Ukol 1: nacteni dat
 def get_dataframe(filename: str, verbose: bool = False) -> pd.DataFrame:
     if not os.path.exists(filename):
         eprint(f'File {filename} doesn\'t exist.')
         return pd.DataFrame()
-    df = pd.read_pickle(filename)
-    if verbose:
-        print("orig_size={:.1f}".format(sum(df.memory_usage(deep=True))/1_048_576), "MB")
-    df.replace('', pd.NA, inplace=True)
-    df = df.astype(column_types)
-    df['p37'] = pd.to_numeric(df['p37'], errors='coerce').astype('Int32')
-    df['n'] = pd.to_numeric(df['n'], errors='coerce').astype('Int32')
-    df['r'] = pd.to_numeric(df['r'], errors='coerce').astype('Int32')
-    df['s'] = pd.to_numeric(df['s'], errors='coerce').astype('Int32')
-    df.rename(columns={'p2a': 'date'}, inplace=True)
+    df = load_dataframe(filename)
     if verbose:
-        print("new_size={:.1f}".format(sum(df.memory_usage(deep=True))/1_048_576), "MB")
+        print("orig_size={:.1f}".format(df.attrs["source_memory"]/1_048_576), "MB")
+        print("new_size={:.1f}".format(memory_usage(df)/1_048_576), "MB")
     return df
 
 
 # Ukol 2: následky nehod v jednotlivých regionech
+def conseq_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """Sums of deaths (p13a), severe (p13b) and light (p13c) injuries and count of accidents per region,
+    computed in one pass (np.bincount over region codes), regions are ordered by count of accidents."""
+    region = df['region'].astype('category')
+    codes = region.cat.codes.to_numpy()
+    known = codes >= 0
+    codes = codes[known]
+    size = len(region.cat.categories)
+    summary = pd.DataFrame({collum: np.bincount(codes, weights=df[collum].to_numpy()[known], minlength=size).astype(np.int64)
+                            for collum in ('p13a', 'p13b', 'p13c')}, index=pd.Index(region.cat.categories.astype(str), name='region'))
+    summary['count'] = np.bincount(codes, minlength=size)
+    summary = summary[summary['count'] > 0]
+    return summary.sort_values('count', ascending=False, kind='stable')
+
+
+def save_table(table: pd.DataFrame, filename: str):
+    """Saves aggregated table for other tools, format is given by extension (.csv or .json)."""
+    if filename.endswith('.json'):
+        table.reset_index().to_json(filename, orient='records', force_ascii=False, indent=1)
+    elif filename.endswith('.csv'):
+        table.to_csv(filename)
+    else:
+        raise ValueError(f'Unknown format of file {filename}, use .csv or .json')
+
+
 def plot_conseq(df: pd.DataFrame, fig_location: str = None, show_figure: bool = False):
+    summary = conseq_summary(df).reset_index()  # 14 rows, plots don't depend on size of data
     fig, ax = plt.subplots(4, 1, figsize=(7.75, 10.25))
     fig.set_facecolor('#525050')
     fig.suptitle('Následky nehod v jednotlivých regionech', color='#FFFFFF', alpha=.8)
-    sns.barplot(x='region', y='p13a', data=df, order=df['region'].value_counts().index, ax=ax[0], ci=None, estimator=sum)
-    ax[0].set_ylabel('Úmrtí při nehodách', color='#FFFFFF', alpha=.8)
-    ax[0].set_facecolor('#545252')
-    ax[0].set_xlabel('Regiony', color='#FFFFFF', alpha=.8)
-    ax[0].tick_params(axis='both', which='both', colors='#FFFFFF')
-    sns.barplot(x='region', y='p13b', data=df, order=df['region'].value_counts().index, ax=ax[1], ci=None, estimator=sum)
-    ax[1].set_ylabel('Těžce zranění', color='#FFFFFF', alpha=.8)
-    ax[1].set_facecolor('#545252')
-    ax[1].set_xlabel('Regiony', color='#FFFFFF', alpha=.8)
-    ax[1].tick_params(axis='both', which='both', colors='#FFFFFF')
-    sns.barplot(x='region', y='p13c', data=df, order=df['region'].value_counts().index, ax=ax[2], ci=None, estimator=sum)
-    ax[2].set_ylabel('Lehce zranění', color='#FFFFFF', alpha=.8)
-    ax[2].set_facecolor('#545252')
-    ax[2].set_xlabel('Regiony', color='#FFFFFF', alpha=.8)
-    ax[2].tick_params(axis='both', which='both', colors='#FFFFFF')
-    sns.countplot(x='region', data=df, order=df['region'].value_counts().index, ax=ax[3])
-    ax[3].set_ylabel('Celkový počet nehod', color='#FFFFFF', alpha=.8)
-    ax[3].set_facecolor('#545252')
-    ax[3].set_xlabel('Regiony', color='#FFFFFF', alpha=.8)
-    ax[3].tick_params(axis='both', which='both', colors='#FFFFFF')
+    for i, (collum, label) in enumerate((('p13a', 'Úmrtí při nehodách'), ('p13b', 'Těžce zranění'),
+                                         ('p13c', 'Lehce zranění'), ('count', 'Celkový počet nehod'))):
+        sns.barplot(x='region', y=collum, data=summary, order=summary['region'], ax=ax[i], ci=None)
+        ax[i].set_ylabel(label, color='#FFFFFF', alpha=.8)
+        ax[i].set_facecolor('#545252')
+        ax[i].set_xlabel('Regiony', color='#FFFFFF', alpha=.8)
+        ax[i].tick_params(axis='both', which='both', colors='#FFFFFF')
     fig.tight_layout()
     if fig_location:
         fig.savefig(fig_location)
@@ -138,19 +79,112 @@ def plot_conseq(df: pd.DataFrame, fig_location: str = None, show_figure: bool =
         fig.show()
 
 
+def bincount_table(keys: dict, weights: np.ndarray = None) -> pd.Series:
+    """Counts (or sums of weights) of rows for every combination of keys, computed by single np.bincount
+    over combined integer codes of keys.
+    keys: name: (codes, labels) - codes is integer array (-1 = row isn't counted), labels[code] is label of group
+    Returns Series with MultiIndex of all combinations of labels (in order of keys), missing combinations are 0."""
+    codes = [np.asarray(c, dtype=np.int64) for c, _ in keys.values()]
+    shape = tuple(len(labels) for _, labels in keys.values())
+    valid = np.logical_and.reduce([(c >= 0) & (c < n) for c, n in zip(codes, shape)])
+    flat = np.ravel_multi_index(tuple(c[valid] for c in codes), shape)
+    counts = np.bincount(flat, weights=None if weights is None else np.asarray(weights)[valid], minlength=int(np.prod(shape)))
+    index = pd.MultiIndex.from_product([labels for _, labels in keys.values()], names=list(keys))
+    return pd.Series(counts, index=index, name='count')
+
+
+def label_codes(values, labels: list) -> np.ndarray:
+    """Codes of values for bincount_table: position of value in labels, -1 for other values."""
+    return pd.Categorical(values, categories=labels).codes
+
+
+def interval_codes(values, edges: list) -> np.ndarray:
+    """Codes of values for bincount_table: index of interval [edges[i], edges[i + 1]), -1 outside of edges."""
+    codes = np.searchsorted(edges, np.asarray(values), side='right') - 1
+    return np.where(codes < len(edges) - 1, codes, -1)
+
+
+def month_codes(dates) -> tuple:
+    """Codes of dates for bincount_table: number of month from first month in data, returns (codes, first days of months)."""
+    months = np.asarray(dates, dtype='datetime64[M]')
+    known = ~np.isnat(months)
+    if not known.any():
+        return np.full(months.shape, -1), pd.DatetimeIndex([])
+    first, last = months[known].min(), months[known].max()
+    codes = np.where(known, (months - first).astype(np.int64), -1)
+    return codes, pd.DatetimeIndex(np.arange(first, last + 1).astype('datetime64[ns]'))
+
+
+# Skupiny příčin nehody (p12 // 100)
+cause_labels = ['nezaviněná řidičem', 'nepřiměřená rychlost jízdy', 'nesprávné předjíždění',
+                'nedání přednosti v jízdě', 'nesprávný způsob jízdy', 'technická závada vozidla']
+# Intervaly škody na vozidle v p53 (stovky Kč) a jejich popisky (tisíce Kč)
+damage_edges = [0, 500, 2000, 5000, 10000, np.inf]
+damage_labels = ['< 50', '50 - 200', '200 - 500', '500 - 1000', '> 1000']
+# Stav povrchu vozovky (p16)
+surface_labels = ['jiný stav', 'suchý neznečištěný', 'suchý znečištěný', 'mokrý', 'bláto', 'náledí, ujetý sníh - posypané',
+                  'náledí, ujetý sníh - neposypané', 'rozlitý olej, nafta apod.', 'souvislá sněhová vrstva', 'náhlá změna stavu']
+
+
+def damage_table(df: pd.DataFrame, regions: list = None) -> pd.DataFrame:
+    """Count of accidents per region, damage interval (p53) and cause group (p12)."""
+    regions = regions or sorted(pd.unique(df['region'].astype(str)))
+    table = bincount_table({'region': (label_codes(df['region'], regions), regions),
+                            'damage': (interval_codes(df['p53'].to_numpy(), damage_edges), damage_labels),
+                            'cause': (df['p12'].to_numpy() // 100 - 1, cause_labels)})
+    return table.reset_index()
+
+
+def surface_table(df: pd.DataFrame, regions: list = None) -> pd.DataFrame:
+    """Monthly counts of accidents per region (rows: region, month) and surface state p16 (collums)."""
+    regions = regions or sorted(pd.unique(df['region'].astype(str)))
+    months, month_labels = month_codes(df['date'].to_numpy())
+    table = bincount_table({'region': (label_codes(df['region'], regions), regions), 'month': (months, month_labels),
+                            'surface': (df['p16'].to_numpy(), surface_labels)})
+    return table.unstack('surface')[surface_labels]  # unstack sorts collums by name
+
 
 # Ukol3: příčina nehody a škoda
 def plot_damage(df: pd.DataFrame, fig_location: str = None, show_figure: bool = False):
     regions = ['STC', 'JHC', 'JHM', 'PHA']
-    fig, ax = plt.subplots(2, 2)
-    data = list()
-    for region in regions:
-        data.append(df.loc[df.region == region, ['region', 'p53', 'p12']])
+    table = damage_table(df, regions)
+    fig, ax = plt.subplots(2, 2, figsize=(10.25, 7.75), sharey=True)
+    for axis, region in zip(ax.flat, regions):
+        sns.barplot(x='damage', y='count', hue='cause', data=table[table['region'] == region], order=damage_labels,
+                    hue_order=cause_labels, ax=axis, ci=None)
+        axis.set_yscale('log')
+        axis.set_title(region)
+        axis.set_xlabel('Škoda [tisíc Kč]')
+        axis.set_ylabel('Počet')
+        axis.get_legend().remove()
+    handles, labels = ax[0, 0].get_legend_handles_labels()
+    fig.legend(handles, labels, title='Příčina nehody', loc='lower center', ncol=3)
+    fig.tight_layout(rect=(0, 0.1, 1, 1))
+    if fig_location:
+        fig.savefig(fig_location)
+    if show_figure is True:
+        fig.show()
 
 
 # Ukol 4: povrch vozovky
 def plot_surface(df: pd.DataFrame, fig_location: str = None, show_figure: bool = False):
-    pass
+    regions = ['STC', 'JHC', 'JHM', 'PHA']
+    table = surface_table(df, regions)
+    fig, ax = plt.subplots(2, 2, figsize=(10.25, 7.75), sharex=True, sharey=True)
+    for axis, region in zip(ax.flat, regions):
+        sns.lineplot(data=table.loc[region], dashes=False, ax=axis, legend=region == regions[0])
+        axis.set_title(region)
+        axis.set_xlabel('Datum vzniku nehody')
+        axis.set_ylabel('Počet nehod')
+    handles, labels = ax[0, 0].get_legend_handles_labels()
+    ax[0, 0].get_legend().remove()
+    fig.legend(handles, labels, title='Stav vozovky', loc='lower center', ncol=4)
+    fig.autofmt_xdate()
+    fig.tight_layout(rect=(0, 0.12, 1, 1))
+    if fig_location:
+        fig.savefig(fig_location)
+    if show_figure is True:
+        fig.show()
 
 
 if __name__ == "__main__":
@@ -160,5 +194,6 @@ if __name__ == "__main__":
     # funkce.
     df = get_dataframe("accidents.pkl.gz", True)
     plot_conseq(df, fig_location="01_nasledky.png", show_figure=True)
+    save_table(conseq_summary(df), "01_nasledky.csv")
     plot_damage(df, "02_priciny.png", True)
     plot_surface(df, "03_stav.png", True)
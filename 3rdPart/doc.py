@@ -7,73 +7,10 @@ import numpy as np
 import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from accidents import load_dataframe
+
 
-column_types = {
-    "p1": 'int64',
-    "p36": 'int8',
-    # "p37": 'int32',
-    "p2a": 'datetime64',
-    "weekday(p2a)": 'int8',
-    "p2b": 'int16',
-    "p6": 'int8',
-    "p7": 'int8',
-    "p8": 'int8',
-    "p9": 'int8',
-    "p10": 'int8',
-    "p11": 'int8',
-    "p12": 'int16',
-    "p13a": 'int16',
-    "p13b": 'int16',
-    "p13c": 'int16',
-    "p14": 'int64',
-    "p15": 'int8',
-    "p16": 'int8',
-    "p17": 'int8',
-    "p18": 'int8',
-    "p19": 'int8',
-    "p20": 'int8',
-    "p21": 'int8',
-    "p22": 'int8',
-    "p23": 'int8',
-    "p24": 'int8',
-    "p27": 'int8',
-    "p28": 'int8',
-    "p34": 'int8',
-    "p35": 'int8',
-    "p39": 'int8',
-    "p44": 'int8',
-    "p45a": 'int8',
-    "p47": 'int8',
-    "p48a": 'int8',
-    "p49": 'int8',
-    "p50a": 'int8',
-    "p50b": 'int8',
-    "p51": 'int8',
-    "p52": 'int8',
-    "p53": 'int64',
-    "p55a": 'int8',
-    "p57": 'int8',
-    "p58": 'int8',
-    "a": 'str',
-    "b": 'str',
-    "d": 'float64',
-    "e": 'float64',
-    "f": 'float64',
-    "g": 'float64',
-    "h": 'str',
-    "i": 'str',
-    "j": 'str',
-    "k": 'str',
-    "l": 'str',
-    "n": 'str',
-    "o": 'str',
-    "p": 'str',
-    "q": 'str',
-    "r": 'str',
-    "s": 'str',
-    "t": 'str',
-    "p5a": 'int8'
-}
 car_brand = {
     1:	'ALFA-ROMEO',
     2:	'AUDI',
@@ -153,24 +90,55 @@ def get_dataframe(filename: str) -> pd.DataFrame:
     if not os.path.exists(filename):  # Check if file exist
         print(f'File {filename} doesn\'t exist.', file=sys.stderr)
         raise ValueError(f'File: {filename} doesn\'t exists!')
-    df = pd.read_pickle(filename)
-    df = df.astype(column_types)
-    df['p37'] = pd.to_numeric(df['p37'], errors='coerce').astype('Int32')  # Coerce missing values to NA
-    df['n'] = pd.to_numeric(df['n'], errors='coerce').astype('Int32')  # Coerce missing values to NA
-    df['r'] = pd.to_numeric(df['r'], errors='coerce').astype('Int32')  # Coerce missing values to NA
-    df['s'] = pd.to_numeric(df['s'], errors='coerce').astype('Int32')  # Coerce missing values to NA
-    df.rename(columns={'p2a': 'date'}, inplace=True)
-    return df
+    return load_dataframe(filename)
+
+
+class MaskedRows:
+    """ Řádky DataFrame vybrané maskou, sloupec se převede na numpy pole jen jednou (při prvním použití) """
+    def __init__(self, df: pd.DataFrame, mask: np.ndarray):
+        self.df = df
+        self.mask = mask
+        self.collums = {}
+
+    def __getitem__(self, collum: str) -> np.ndarray:
+        if collum not in self.collums:
+            self.collums[collum] = self.df[collum].to_numpy()[self.mask]
+        return self.collums[collum]
+
+
+def brand_stats(df: pd.DataFrame, metrics: dict, ratios: dict = None) -> pd.DataFrame:
+    """ Spočítá metriky pro každou značku (p45a) osobních a nákladních aut (p44 3-7) z jednoho průchodu daty.
+    metrics: název: funkce(MaskedRows) -> (maska řádků nebo None, hodnoty k sečtení nebo None pro počet řádků)
+    ratios: název: (čitatel, jmenovatel) - podíly metrik
+    Každá metrika je jeden np.bincount nad kódem značky, další metrika tedy nevyžaduje další průchod celou tabulkou. """
+    p44 = df['p44'].to_numpy()
+    rows = MaskedRows(df, (p44 >= 3) & (p44 <= 7))
+    brands = rows['p45a'].astype(np.int64)
+    low = min(int(brands.min()), 0) if brands.size else 0  # Neznámá značka (-1) je také skupina
+    codes = brands - low
+    size = int(codes.max()) + 1 if codes.size else 0
+    result = {}
+    for name, metric in metrics.items():
+        mask, values = metric(rows)
+        brand_codes = codes if mask is None else codes[mask]
+        if values is None:
+            result[name] = np.bincount(brand_codes, minlength=size)
+        else:
+            values = np.asarray(values if mask is None else values[mask])
+            sums = np.bincount(brand_codes, weights=values, minlength=size)
+            result[name] = np.rint(sums).astype(np.int64) if np.issubdtype(values.dtype, np.integer) else sums
+    df_stats = pd.DataFrame(result, index=pd.RangeIndex(low, low + size, name='znacky'))
+    df_stats = df_stats[(df_stats != 0).any(axis=1)]  # Pouze značky, které jsou v datech
+    for name, (numerator, denominator) in (ratios or {}).items():
+        df_stats[name] = df_stats[numerator] / df_stats[denominator]
+    return df_stats.rename(index=car_brand)
 
 
 def plot_cars(df: pd.DataFrame, fname: str = None, show: bool = False):
     """ Vykreslí graf nejvíce bouraných značek osobních a nákladních aut. """
     fig, ax = plt.subplots(1, 1)
-    df_cars = pd.DataFrame({'znacky': df.loc[(df['p44'] >= 3) & (df['p44'] <= 7)]['p45a']})
-    df_cars = df_cars[df_cars['znacky'] != -1]
-    df_cars['pocet'] = 1
-    df_cars = df_cars.groupby('znacky').count()
-    df_cars.rename(index=car_brand, inplace=True)
+    df_cars = brand_stats(df, {'pocet': lambda rows: (rows['p45a'] != -1, None)})
+    df_cars = df_cars[df_cars['pocet'] > 0]
     df_cars_major = df_cars[df_cars['pocet'] >= 8000]
     sns.barplot(x=df_cars_major.index, y='pocet', data=df_cars_major, order=df_cars_major.sort_values('pocet', ascending=False).index, ax=ax, palette=sns.color_palette("magma", n_colors=16))
     ax.set_xticklabels(ax.get_xticklabels(), rotation=60)
@@ -185,12 +153,11 @@ def plot_cars(df: pd.DataFrame, fname: str = None, show: bool = False):
 
 
 def table(df: pd.DataFrame):
-    df_new = df[(df['p13a'] != -1) & (df['p13b'] != -1) & (df['p13c'] != -1) & (df['p44'] >= 3) & (df['p44'] <= 7) & (df['p45a'] != 99) & (df['p45a'] != 98) & (df['p45a'] != 0) & (df['p45a'] != 94)]
-    df_new = pd.DataFrame({'znacky': df_new['p45a'], 'zraneni': df_new['p13a'] + df_new['p13b'] + df_new['p13c']})
-    df_new['pocet'] = 1
-    df_new = df_new.groupby('znacky').sum()
-    df_new['prumer'] = df_new['zraneni'] / df_new['pocet']
-    df_new.rename(index=car_brand, inplace=True)
+    def injured(rows):
+        known = (rows['p13a'] != -1) & (rows['p13b'] != -1) & (rows['p13c'] != -1) & ~np.isin(rows['p45a'], [99, 98, 0, 94])
+        return known, rows['p13a'].astype(np.int64) + rows['p13b'] + rows['p13c']
+    df_new = brand_stats(df, {'zraneni': injured, 'pocet': lambda rows: (injured(rows)[0], None)}, ratios={'prumer': ('zraneni', 'pocet')})
+    df_new = df_new[df_new['pocet'] > 0]
     df_new.sort_values('prumer', inplace=True, ascending=False)
     df_new = df_new[df_new['pocet'] > 1000]
     print('Tabulka 5 značek s nejvyšší průměrnou škodou na vozidle')
@@ -198,42 +165,28 @@ def table(df: pd.DataFrame):
 
 
 def values(df: pd.DataFrame):
+    # Všechny metriky se spočítají najednou
+    damage = lambda rows: rows['p53'] != -1  # Známá škoda
+    drugs = lambda rows: damage(rows) & (rows['p11'] != 0) & (rows['p11'] != -1)  # Známý vliv návykových látek
+    cause = lambda rows: damage(rows) & (rows['p12'] != -1)  # Známá příčina
+    df_stats = brand_stats(df, {
+        'skoda': lambda rows: (damage(rows), 100 * rows['p53'].astype(np.int64)),
+        'pocet skoda': lambda rows: (damage(rows), None),
+        'pod vlivem': lambda rows: (drugs(rows) & (rows['p11'] != 2), None),
+        'pocet vliv': lambda rows: (drugs(rows), None),
+        'rychla jizda': lambda rows: (cause(rows) & (rows['p12'] >= 201) & (rows['p12'] <= 209), None),
+        'pocet rychlost': lambda rows: (cause(rows), None),
+    }, ratios={'prumerna skoda': ('skoda', 'pocet skoda'), 'podil pod vlivem': ('pod vlivem', 'pocet vliv'),
+               'podil rychle jizdy': ('rychla jizda', 'pocet rychlost')})
     # Značka auta + nejvyšší škody na autech
-    df_new = df[(df['p53'] != -1) & (df['p44'] >= 3) & (df['p44'] <= 7)]
-    df_new = pd.DataFrame({'znacky': df_new['p45a'], 'skoda': df_new['p53']})
-    df_new['skoda'] = 100 * df_new['skoda']
-    df_new['pocet'] = 1
-    df_new = df_new.groupby('znacky').sum()
-    df_new.rename(index=car_brand, inplace=True)
-    df_new['prumerna skoda'] = df_new['skoda'] / df_new['pocet']
-    df_new.sort_values('prumerna skoda', inplace=True, ascending=False)
+    df_new = df_stats[df_stats['pocet skoda'] > 0].sort_values('prumerna skoda', ascending=False)
     print("Hodnoty:")
     print(f"\tZnačka auta s nejvyší průměrnou škodou/1 nehodu: {df_new.iloc[0].name} {round(df_new.iloc[0]['prumerna skoda'], 2)}")
     # Značka auta + nejvíce nehod pod vlivem návykových látek
-    df_new = df[(df['p11'] != 0) & (df['p11'] != -1) & (df['p53'] != -1) & (df['p44'] >= 3) & (df['p44'] <= 7)]
-    df_new = pd.DataFrame({'znacky': df_new['p45a'], 'navikove latky': df_new['p11']})
-    df_new['pod vlivem'] = 1
-    df_new['pocet'] = 1
-    df_new.loc[(df_new['navikove latky'] == 2), 'pod vlivem'] = 0
-    df_new.drop("navikove latky", axis=1, inplace=True)
-    df_new = df_new.groupby('znacky').sum()
-    df_new.rename(index=car_brand, inplace=True)
-    df_new = df_new[df_new['pocet'] > 1000]
-    df_new['podil pod vlivem'] = df_new['pod vlivem'] / df_new['pocet']
-    df_new.sort_values('podil pod vlivem', inplace=True, ascending=False)
+    df_new = df_stats[df_stats['pocet vliv'] > 1000].sort_values('podil pod vlivem', ascending=False)
     print(f"\tZnačka auta jehož řidiči mají nejčastěji nehodu pod vlivem návykových látek: {df_new.iloc[0].name} {round(df_new.iloc[0]['podil pod vlivem'], 2) * 100}%")
     # Značka auta + nejvíce nehod při vysoké rychlosti
-    df_new = df[(df['p12'] != -1) & (df['p53'] != -1) & (df['p44'] >= 3) & (df['p44'] <= 7)]
-    df_new = pd.DataFrame({'znacky': df_new['p45a'], 'pricina': df_new['p12']})
-    df_new['rychla jizda'] = 0
-    df_new['pocet'] = 1
-    df_new.loc[(df_new['pricina'] >= 201) & (df_new['pricina'] <= 209), 'rychla jizda'] = 1
-    df_new.drop("pricina", axis=1, inplace=True)
-    df_new = df_new.groupby('znacky').sum()
-    df_new.rename(index=car_brand, inplace=True)
-    df_new = df_new[df_new['pocet'] > 1000]
-    df_new['podil rychle jizdy'] = df_new['rychla jizda'] / df_new['pocet']
-    df_new.sort_values('podil rychle jizdy', inplace=True, ascending=False)
+    df_new = df_stats[df_stats['pocet rychlost'] > 1000].sort_values('podil rychle jizdy', ascending=False)
     print(f"\tZnačka auta jehož řidiči mají nejčastěji nehodu kvůli vysoké rychlosti: {df_new.iloc[0].name} {round(df_new.iloc[0]['podil rychle jizdy'], 2) * 100}%")
 #%%
 if __name__ == '__main__':
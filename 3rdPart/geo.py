@@ -6,94 +6,314 @@ import matplotlib.pyplot as plt
 import contextily as ctx
 import sklearn.cluster
 import numpy as np
+import os
+import sys
+import hashlib
+import tempfile
+from pyproj import Transformer
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+import requests
+import re
 # muzeze pridat vlastni knihovny
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from accidents import type_dataframe, load_dataframe
 # %%
-# Dictionary of column names and datatypes
-column_types = {
-    "p1": 'int64',
-    "p36": 'int8',
-    # "p37": 'int32',
-    "p2a": 'datetime64',
-    "weekday(p2a)": 'int8',
-    "p2b": 'int16',
-    "p6": 'int8',
-    "p7": 'int8',
-    "p8": 'int8',
-    "p9": 'int8',
-    "p10": 'int8',
-    "p11": 'int8',
-    "p12": 'int16',
-    "p13a": 'int16',
-    "p13b": 'int16',
-    "p13c": 'int16',
-    "p14": 'int64',
-    "p15": 'int8',
-    "p16": 'int8',
-    "p17": 'int8',
-    "p18": 'int8',
-    "p19": 'int8',
-    "p20": 'int8',
-    "p21": 'int8',
-    "p22": 'int8',
-    "p23": 'int8',
-    "p24": 'int8',
-    "p27": 'int8',
-    "p28": 'int8',
-    "p34": 'int8',
-    "p35": 'int8',
-    "p39": 'int8',
-    "p44": 'int8',
-    "p45a": 'int8',
-    "p47": 'int8',
-    "p48a": 'int8',
-    "p49": 'int8',
-    "p50a": 'int8',
-    "p50b": 'int8',
-    "p51": 'int8',
-    "p52": 'int8',
-    "p53": 'int64',
-    "p55a": 'int8',
-    "p57": 'int8',
-    "p58": 'int8',
-    "a": 'str',
-    "b": 'str',
-    "d": 'float64',
-    "e": 'float64',
-    "f": 'float64',
-    "g": 'float64',
-    "h": 'str',
-    "i": 'str',
-    "j": 'str',
-    "k": 'str',
-    "l": 'str',
-    "n": 'str',
-    "o": 'str',
-    "p": 'str',
-    "q": 'str',
-    "r": 'str',
-    "s": 'str',
-    "t": 'str',
-    "p5a": 'int8'
-}
+# Transformace z křováka do Web Mercator (EPSG:3857), ve kterém jsou mapové podklady
+krovak_to_mercator = Transformer.from_crs('epsg:5514', 'epsg:3857', always_xy=True)
 
 
 def make_geo(df: pd.DataFrame) -> geopandas.GeoDataFrame:
     """ Konvertovani dataframe do geopandas.GeoDataFrame se spravnym kodovani"""
-    df = df.astype(column_types)
-    df['p37'] = pd.to_numeric(df['p37'], errors='coerce').astype('Int32')  # Coerce missing values to NA
-    df['n'] = pd.to_numeric(df['n'], errors='coerce').astype('Int32')  # Coerce missing values to NA
-    df['r'] = pd.to_numeric(df['r'], errors='coerce').astype('Int32')  # Coerce missing values to NA
-    df['s'] = pd.to_numeric(df['s'], errors='coerce').astype('Int32')  # Coerce missing values to NA
-    df.rename(columns={'p2a': 'date'}, inplace=True)
-    df.drop(df.loc[~np.isfinite(df['d'])].index, inplace=True)
-    df.drop(df.loc[~np.isfinite(df['e'])].index, inplace=True)
-    df.drop(df.loc[~np.isfinite(df['f'])].index, inplace=True)
-    df.drop(df.loc[~np.isfinite(df['g'])].index, inplace=True)
+    if 'date' not in df:  # Data loaded directly by pd.read_pickle
+        df = type_dataframe(df)
+    valid = np.isfinite(df[['d', 'e', 'f', 'g']].to_numpy()).all(axis=1)  # Jediný průchod přes všechny souřadnice
+    df = df[valid]
+    merc_x, merc_y = krovak_to_mercator.transform(df['d'].to_numpy(), df['e'].to_numpy())
+    df = df.assign(merc_x=merc_x.astype(np.float32), merc_y=merc_y.astype(np.float32))  # Souřadnice pro vykreslení
     gdf = geopandas.GeoDataFrame(
         df, geometry=geopandas.points_from_xy(df.d, df.e), crs='epsg:5514')  # CRS křovák
     return gdf
 
 
+class GridIndex:
+    """ Prostorový index bodů v pravidelné mřížce (buňky o straně cell metrů).
+    Body jsou seřazeny podle buňky (po řádcích mřížky), takže řádek buněk v obdélníku je jeden souvislý úsek polí.
+    Dotazy vrací pozice bodů v polích x, y, ze kterých byl index vytvořen. """
+    def __init__(self, x: np.ndarray, y: np.ndarray, cell: float = 500):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.cell = float(cell)
+        self.x0 = x.min() if x.size else 0.
+        self.y0 = y.min() if y.size else 0.
+        ix = ((x - self.x0) // self.cell).astype(np.int64)
+        iy = ((y - self.y0) // self.cell).astype(np.int64)
+        self.nx = int(ix.max()) + 1 if x.size else 1
+        self.ny = int(iy.max()) + 1 if y.size else 1
+        cells = iy * self.nx + ix
+        self.order = np.argsort(cells, kind='stable')
+        self.starts = np.searchsorted(cells[self.order], np.arange(self.nx * self.ny + 1))  # Začátek každé buňky
+        self.x = x[self.order]
+        self.y = y[self.order]
+
+    def __len__(self):
+        return self.order.size
+
+    def candidates(self, xmin: float, ymin: float, xmax: float, ymax: float) -> np.ndarray:
+        """ Indexy (do seřazených polí) bodů v buňkách, které zasahují do obdélníku """
+        if xmax < self.x0 or ymax < self.y0 or xmin > self.x0 + self.nx * self.cell or ymin > self.y0 + self.ny * self.cell:
+            return np.empty(0, dtype=np.int64)
+        ix0, ix1 = np.clip((np.array([xmin, xmax]) - self.x0) // self.cell, 0, self.nx - 1).astype(np.int64)
+        iy0, iy1 = np.clip((np.array([ymin, ymax]) - self.y0) // self.cell, 0, self.ny - 1).astype(np.int64)
+        rows = np.arange(iy0, iy1 + 1) * self.nx
+        begins = self.starts[rows + ix0]
+        ends = self.starts[rows + ix1 + 1]
+        lengths = ends - begins
+        # Spojení úseků begin:end bez cyklu v Pythonu
+        return np.repeat(begins - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    def bbox(self, xmin: float, ymin: float, xmax: float, ymax: float) -> np.ndarray:
+        """ Pozice bodů v obdélníku (včetně hranice) """
+        sel = self.candidates(xmin, ymin, xmax, ymax)
+        x, y = self.x[sel], self.y[sel]
+        return self.order[sel[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)]]
+
+    def radius(self, x: float, y: float, r: float, return_distance: bool = False):
+        """ Pozice bodů ve vzdálenosti nejvýše r od bodu (x, y), volitelně i jejich vzdálenosti """
+        sel = self.candidates(x - r, y - r, x + r, y + r)
+        dist = np.hypot(self.x[sel] - x, self.y[sel] - y)
+        inside = dist <= r
+        if return_distance:
+            return self.order[sel[inside]], dist[inside]
+        return self.order[sel[inside]]
+
+    def nearest(self, x: float, y: float, k: int = 1, return_distance: bool = False):
+        """ Pozice k nejbližších bodů k bodu (x, y) seřazené podle vzdálenosti, volitelně i jejich vzdálenosti """
+        k = min(k, len(self))
+        r = self.cell
+        extent = np.hypot(self.nx * self.cell, self.ny * self.cell) + np.hypot(x - self.x0, y - self.y0)
+        while True:
+            sel = self.candidates(x - r, y - r, x + r, y + r)
+            dist = np.hypot(self.x[sel] - x, self.y[sel] - y)
+            # Výsledek je správný, pokud je k bodů uvnitř kruhu o poloměru r (body mimo čtverec jsou dál než r)
+            if np.count_nonzero(dist <= r) >= k or r > extent:
+                break
+            r *= 2
+        best = np.argpartition(dist, k - 1)[:k] if k < dist.size else np.arange(dist.size)
+        best = best[np.argsort(dist[best], kind='stable')]
+        if return_distance:
+            return self.order[sel[best]], dist[best]
+        return self.order[sel[best]]
+
+    def save(self, filename: str):
+        np.savez(filename, x0=self.x0, y0=self.y0, cell=self.cell, nx=self.nx, ny=self.ny,
+                 order=self.order, starts=self.starts, x=self.x, y=self.y)
+
+    @classmethod
+    def load(cls, filename: str):
+        index = cls.__new__(cls)
+        with np.load(filename) as data:
+            index.x0, index.y0, index.cell = float(data['x0']), float(data['y0']), float(data['cell'])
+            index.nx, index.ny = int(data['nx']), int(data['ny'])
+            index.order, index.starts, index.x, index.y = data['order'], data['starts'], data['x'], data['y']
+        return index
+
+
+# Returns sha256 of coordinates (key of spatial index)
+def coordinates_key(x: np.ndarray, y: np.ndarray) -> str:
+    checksum = hashlib.sha256()
+    checksum.update(np.ascontiguousarray(x, dtype=np.float64).tobytes())
+    checksum.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+    return checksum.hexdigest()
+
+
+def accident_index(gdf: pd.DataFrame, filename: str = None, cell: float = 500) -> GridIndex:
+    """ Prostorový index nehod podle souřadnic d, e (EPSG:5514, metry), pozice odpovídají řádkům gdf (gdf.iloc).
+    Je-li zadán soubor s daty (accidents.pkl.gz), index je uložen vedle cache dat a znovu použit, dokud se nezmění souřadnice. """
+    x, y = gdf['d'].to_numpy(dtype=np.float64), gdf['e'].to_numpy(dtype=np.float64)
+    key = coordinates_key(x, y)
+    if filename:
+        index_filename = f"{filename}.cache/spatial_index_{key[:16]}_{int(cell)}.npz"
+        if os.path.exists(index_filename):
+            return GridIndex.load(index_filename)
+    index = GridIndex(x, y, cell)
+    if filename:
+        try:  # Cache dat se při změně souboru maže celá, i se starými indexy
+            index.save(index_filename)
+        except OSError:  # Index se jen neuloží
+            pass
+    return index
+
+
+def mercator_xy(gdf: pd.DataFrame):
+    """ Souřadnice nehod ve Web Mercator (EPSG:3857), spočítané jednou v make_geo """
+    if 'merc_x' not in gdf:
+        return krovak_to_mercator.transform(gdf['d'].to_numpy(), gdf['e'].to_numpy())
+    return gdf['merc_x'].to_numpy(), gdf['merc_y'].to_numpy()
+
+
+# Polovina šířky světa ve Web Mercator (m), dlaždice na úrovni z mají stranu 2 * mercator_extent / 2 ** z
+mercator_extent = 20037508.342789244
+
+
+def tile_url(provider, z: int, x: int, y: int) -> str:
+    """ Adresa (nebo cesta k souboru) dlaždice, provider je TileProvider z ctx.providers nebo šablona s {z}, {x}, {y} """
+    if hasattr(provider, "build_url"):
+        return provider.build_url(x=x, y=y, z=z)
+    return provider.format(z=z, x=x, y=y)
+
+
+def default_provider():
+    """ Stamen Toner Lite: starší xyzservices ho mají jako Stamen.TonerLite, novější jen přes Stadia (Stadia.StamenTonerLite) """
+    try:
+        return ctx.providers.Stamen.TonerLite
+    except AttributeError:
+        return ctx.providers.Stadia.StamenTonerLite
+
+
+def provider_name(provider) -> str:
+    """ Název poskytovatele dlaždic použitelný jako adresář """
+    return re.sub(r'[^0-9A-Za-z.-]+', '_', getattr(provider, "name", None) or str(provider)).strip('_')
+
+
+class TileCache:
+    """ Lokální úložiště mapových dlaždic adresované obsahem: data jsou v objects/<sha256>, klíč provider/z/x/y odkazuje na obsah (refs/).
+    mode: "fill" - chybějící dlaždice se jednou stáhnou a uloží, dál se používají jen uložené
+          "offline" - bez sítě, dlaždice jen z úložiště nebo z lokálního adresáře tile_dir (šablona cesty s {z}, {x}, {y}) """
+    def __init__(self, folder: str = "tiles", mode: str = "fill", tile_dir: str = None):
+        if mode not in ("fill", "offline"):
+            raise ValueError(f"Unknown tile cache mode: {mode}")
+        self.folder = folder
+        self.mode = mode
+        self.tile_dir = tile_dir
+        self.session = None
+        self.headers = {'User-Agent': getattr(ctx.tile, "USER_AGENT", "contextily")}  # Servery dlaždic vyžadují identifikaci klienta
+
+    def ref_filename(self, provider, z: int, x: int, y: int) -> str:
+        return os.path.join(self.folder, "refs", provider_name(provider), str(z), str(x), f"{y}.txt")
+
+    def object_filename(self, digest: str) -> str:
+        return os.path.join(self.folder, "objects", digest[:2], digest[2:])
+
+    def get(self, provider, z: int, x: int, y: int):
+        """ Obsah dlaždice (bytes) nebo None, pokud ji nelze získat """
+        try:
+            with open(self.ref_filename(provider, z, x, y), 'r') as f:
+                with open(self.object_filename(f.read().strip()), 'rb') as tile:
+                    return tile.read()
+        except OSError:
+            pass
+        data = None
+        if self.tile_dir:
+            data = self.read_file(self.tile_dir.format(z=z, x=x, y=y))
+        if data is None:
+            url = tile_url(provider, z, x, y)
+            if not url.startswith(("http://", "https://")):  # Lokální adresář s dlaždicemi místo serveru
+                data = self.read_file(url)
+            elif self.mode == "fill":
+                data = self.download(url)
+        if data is not None:
+            self.put(provider, z, x, y, data)
+        return data
+
+    def put(self, provider, z: int, x: int, y: int, data: bytes):
+        """ Uloží dlaždici, stejný obsah (např. prázdné dlaždice) je uložen jen jednou """
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self.object_filename(digest)):
+            try:
+                self.write_file(self.object_filename(digest), data)
+            except OSError:
+                if not os.path.exists(self.object_filename(digest)):
+                    raise
+                # Stejný objekt mezitím uložil jiný proces, obsah je podle hashe stejný
+        self.write_file(self.ref_filename(provider, z, x, y), digest.encode())
+
+    @staticmethod
+    def write_file(fname: str, data: bytes):
+        """ Atomický zápis, každý zapisovatel má vlastní dočasný soubor (souběžně kreslené grafy sdílí dlaždice) """
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(fname), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_fname, fname)
+        except OSError:
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+            raise
+
+    @staticmethod
+    def read_file(fname: str):
+        try:
+            with open(fname, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def download(self, url: str):
+        if self.session is None:
+            self.session = requests.Session()
+            self.session.headers.update(self.headers)
+        try:
+            resp = self.session.get(url, timeout=30)
+        except requests.RequestException:
+            return None
+        return resp.content if resp.status_code == 200 else None
+
+
+# Úložiště dlaždic používané při vykreslování, lze nahradit např. TileCache("tiles", mode="offline")
+tile_cache = TileCache()
+
+
+def tile_image(data: bytes) -> np.ndarray:
+    """ Dlaždice jako pole RGBA (float32, 0-1) """
+    img = plt.imread(BytesIO(data))
+    if img.dtype == np.uint8:
+        img = img / 255
+    if img.ndim == 2:  # Stupně šedi
+        img = np.dstack([img] * 3)
+    if img.shape[2] == 3:
+        img = np.dstack([img, np.ones(img.shape[:2])])
+    return img.astype(np.float32)
+
+
+def basemap_raster(extent, zoom: int = 8, provider=None, cache: TileCache = None):
+    """ Mapový podklad pro oblast extent (xmin, xmax, ymin, ymax v epsg:3857) složený z dlaždic úrovně zoom.
+    provider: TileProvider z ctx.providers nebo šablona s {z}, {x}, {y}, implicitně default_provider().
+    Vrací (obrázek, (left, right, bottom, top), atribuce) pro imshow, nebo None, pokud není dostupná žádná dlaždice.
+    Stejný podklad lze vykreslit do více grafů (draw_basemap), dlaždice se tak načtou jen jednou. """
+    provider = provider if provider is not None else default_provider()
+    cache = cache or tile_cache
+    xmin, xmax, ymin, ymax = extent
+    n = 2 ** zoom
+    size = 2 * mercator_extent / n
+    x0, x1 = (np.clip((np.array([xmin, xmax]) + mercator_extent) // size, 0, n - 1)).astype(int)
+    y0, y1 = (np.clip((mercator_extent - np.array([ymax, ymin])) // size, 0, n - 1)).astype(int)
+    tiles = {(x, y): cache.get(provider, zoom, x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)}
+    tiles = {xy: tile_image(data) for xy, data in tiles.items() if data is not None}
+    if not tiles:
+        return None
+    tile_h, tile_w = next(iter(tiles.values())).shape[:2]
+    image = np.zeros(((y1 - y0 + 1) * tile_h, (x1 - x0 + 1) * tile_w, 4), dtype=np.float32)  # Chybějící dlaždice jsou průhledné
+    for (x, y), img in tiles.items():
+        image[(y - y0) * tile_h:(y - y0 + 1) * tile_h, (x - x0) * tile_w:(x - x0 + 1) * tile_w] = img[:tile_h, :tile_w]
+    return image, (x0 * size - mercator_extent, (x1 + 1) * size - mercator_extent,
+                   mercator_extent - (y1 + 1) * size, mercator_extent - y0 * size), provider.get("attribution") if isinstance(provider, dict) else None
+
+
+def draw_basemap(ax, raster, alpha: float = 0.9):
+    """ Vykreslí mapový podklad z basemap_raster pod data grafu i s atribucí poskytovatele (jako ctx.add_basemap), rozsah os se nemění """
+    if raster is None:
+        return
+    image, extent, attribution = raster
+    limits = ax.axis()
+    ax.imshow(image, extent=extent, alpha=alpha, interpolation="bilinear", zorder=0)
+    ax.axis(limits)
+    if attribution:
+        ctx.add_attribution(ax, attribution)
+
+
 def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
              show_figure: bool = False):
     """ Vykresleni grafu s dvemi podgrafy podle lokality nehody """
@@ -102,38 +322,93 @@ def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
     ax[0].axis("off")
     ax[1].axis("off")
     gdf2 = gdf.loc[gdf["region"] == "JHC"]
-    gdf2 = gdf2.to_crs("epsg:3857")
-    gdf2[gdf2["p5a"] == 1].plot(ax=ax[0], color="blue", markersize=1)  # V obci
+    x, y = mercator_xy(gdf2)  # Body už jsou převedené do epsg:3857
+    p5a = gdf2["p5a"].to_numpy()
+    ax[0].scatter(x[p5a == 1], y[p5a == 1], color="blue", s=1)  # V obci
     ax[0].set_title('Nehody v obci')
-    gdf2[gdf2["p5a"] == 2].plot(ax=ax[1], color="red", markersize=1)  # Mimo obec
+    ax[1].scatter(x[p5a == 2], y[p5a == 2], color="red", s=1)  # Mimo obec
     ax[1].set_title('Nehody mimo obec')
-    ctx.add_basemap(ax[0], crs=gdf2.crs.to_string(), source=ctx.providers.Stamen.TonerLite, zoom=8, alpha=0.9)
-    ctx.add_basemap(ax[1], crs=gdf2.crs.to_string(), source=ctx.providers.Stamen.TonerLite, zoom=8, alpha=0.9)
+    ax[0].set_aspect('equal')
+    ax[1].set_aspect('equal')
+    raster = basemap_raster(ax[0].axis(), zoom=8)  # Osy jsou sdílené, podklad se načte jednou pro oba grafy
+    draw_basemap(ax[0], raster)
+    draw_basemap(ax[1], raster)
     if fig_location:
         fig.savefig(fig_location)
     if show_figure:
         fig.show()
 
 
+def cluster_labels(x: np.ndarray, y: np.ndarray, k: int = 10, method: str = "kmeans", cell: float = 5000, seed: int = 0) -> np.ndarray:
+    """ Číslo shluku pro každý bod.
+    method: "kmeans" (k shluků, MiniBatchKMeans s pevným seed), "grid" (čtverce o straně cell metrů) nebo "hex" (šestiúhelníky o poloměru cell metrů) """
+    if method == "kmeans":
+        return sklearn.cluster.MiniBatchKMeans(n_clusters=min(k, x.size), random_state=seed).fit_predict(np.column_stack([x, y]))
+    if method == "grid":
+        ix, iy = np.floor(x / cell), np.floor(y / cell)
+    elif method == "hex":  # Šestiúhelníky s vrcholem nahoře, osové souřadnice zaokrouhlené v krychlových souřadnicích
+        q = (np.sqrt(3) / 3 * x - y / 3) / cell
+        r = 2 / 3 * y / cell
+        rq, rr, rs = np.round(q), np.round(r), np.round(-q - r)
+        dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs + q + r)
+        ix = np.where((dq > dr) & (dq > ds), -rr - rs, rq)
+        iy = np.where(~((dq > dr) & (dq > ds)) & (dr > ds), -rq - rs, rr)
+    else:
+        raise ValueError(f"Unknown clustering method: {method}")
+    ix, iy = (ix - ix.min()).astype(np.int64), (iy - iy.min()).astype(np.int64)
+    return np.unique(ix * (iy.max() + 1) + iy, return_inverse=True)[1].reshape(-1)
+
+
+def cluster_points(x: np.ndarray, y: np.ndarray, k: int = 10, method: str = "kmeans", cell: float = 5000, seed: int = 0):
+    """ Shlukování bodů, vrací (počty bodů, x těžiště, y těžiště) neprázdných shluků, vše pomocí np.bincount nad čísly shluků """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    if x.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    labels = cluster_labels(x, y, k, method, cell, seed)
+    counts = np.bincount(labels)
+    used = counts > 0
+    return counts[used], np.bincount(labels, weights=x)[used] / counts[used], np.bincount(labels, weights=y)[used] / counts[used]
+
+
+def cluster_accidents(gdf: pd.DataFrame, k: int = 10, regions: list = None, per_region: bool = False,
+                      method: str = "kmeans", cell: float = 5000, seed: int = 0, workers: int = 4) -> pd.DataFrame:
+    """ Shluky nehod ve Web Mercator (EPSG:3857): DataFrame se sloupci region, count, merc_x, merc_y (těžiště shluku).
+    regions: vybrané kraje (None = všechny), per_region: každý kraj se shlukuje zvlášť (paralelně ve workers procesech),
+    jinak se shlukují všechny vybrané nehody dohromady (region je None). Ostatní parametry viz cluster_labels. """
+    x, y = mercator_xy(gdf)
+    region = gdf["region"].to_numpy()
+    if regions is not None:
+        selected = np.isin(region, regions)
+        x, y, region = x[selected], y[selected], region[selected]
+    if per_region:
+        names = [reg for reg in (regions if regions is not None else pd.unique(region)) if np.any(region == reg)]
+        masks = [region == reg for reg in names]
+    if not per_region or not names:  # Všechny nehody dohromady (nebo žádné nehody)
+        names, masks = [None], [slice(None)]
+    cluster = partial(cluster_points, k=k, method=method, cell=cell, seed=seed)
+    if workers > 1 and len(names) > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(cluster, [x[m] for m in masks], [y[m] for m in masks]))
+    else:
+        results = [cluster(x[m], y[m]) for m in masks]
+    return pd.DataFrame({"region": np.repeat(np.array(names, dtype=object), [r[0].size for r in results]),
+                         "count": np.concatenate([r[0] for r in results]),
+                         "merc_x": np.concatenate([r[1] for r in results]),
+                         "merc_y": np.concatenate([r[2] for r in results])})
+
+
 def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
                  show_figure: bool = False):
     """ Vykresleni grafu s lokalitou vsech nehod v kraji shlukovanych do clusteru """
     fig, ax = plt.subplots(1, 1, sharex=True, sharey=True, figsize=(7.75, 7.75))
     ax.axis("off")
-    gdf2 = gdf.loc[gdf["region"] == "STC"]  # Z celého DataFrame vybereme pouze data z vybraného kraje
-    gdf2 = gdf2.to_crs("epsg:3857")  # Transformujeme body do crs vhodného pro zobrazení
-    coords = np.dstack([gdf2.geometry.x, gdf2.geometry.y]).reshape(-1, 2)
-    kmeans = sklearn.cluster.MiniBatchKMeans(n_clusters=10).fit(coords)
-    gdf3 = geopandas.GeoDataFrame(geometry=gdf2.geometry, crs=gdf2.crs.to_string())
-    gdf3["cluster"] = kmeans.labels_
-    gdf3["count"] = 1
-    gdf3 = gdf3.dissolve(by="cluster", aggfunc={"count": "sum"})
-    cluster_gdf = geopandas.GeoDataFrame(geometry=geopandas.points_from_xy(kmeans.cluster_centers_[:, 0], kmeans.cluster_centers_[:, 1]))
-    gdf3 = gdf3.merge(cluster_gdf, left_on="cluster", right_index=True).set_geometry("geometry_y")
-    gdf3.plot(ax=ax, markersize=gdf3["count"] / 5, column="count", legend=True, alpha=.6)
+    clusters = cluster_accidents(gdf, k=10, regions=["STC"])  # Shluky nehod vybraného kraje
+    points = ax.scatter(clusters["merc_x"], clusters["merc_y"], s=clusters["count"] / 5, c=clusters["count"], alpha=.6)
+    fig.colorbar(points, ax=ax)
+    ax.set_aspect('equal')
     ax.set_title('Nehody ve Strakonickém kraji')
     # Přidáme mapový podklad
-    ctx.add_basemap(ax, crs=gdf2.crs.to_string(), source=ctx.providers.Stamen.TonerLite, zoom=8, alpha=0.9)
+    draw_basemap(ax, basemap_raster(ax.axis(), zoom=8))
     if fig_location:
         fig.savefig(fig_location)
     if show_figure:
@@ -141,6 +416,6 @@ def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
 # %%
 if __name__ == "__main__":
     # zde muzete delat libovolne modifikace
-    gdf = make_geo(pd.read_pickle("accidents.pkl.gz"))
+    gdf = make_geo(load_dataframe("accidents.pkl.gz"))
     plot_geo(gdf, "geo1.png", True)
     plot_cluster(gdf, "geo2.png", True)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3.8
+# coding=utf-8
+# Testy nezávislosti (chí-kvadrát) pro libovolné dvojice kódovaných sloupců, zobecnění stat.ipynb
+import pandas as pd
+import numpy as np
+import scipy.stats
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from accidents import load_dataframe
+
+
+def coded(values) -> tuple:
+    """ (kódy, hodnoty) sloupce nebo pole, chybějící hodnoty (NA, NaN, None) mají kód -1 """
+    codes, labels = pd.factorize(pd.Series(values) if not isinstance(values, pd.Series) else values, sort=True)
+    return codes.astype(np.int64), np.asarray(labels)
+
+
+def contingency(x, y, where=None) -> pd.DataFrame:
+    """ Kontingenční tabulka dvou sloupců (řádky hodnoty x, sloupce hodnoty y) spočítaná jedním np.bincount nad spojenými kódy.
+    x, y: pole/Series nebo již kódované (kódy, hodnoty) z coded, where: maska řádků, které se počítají.
+    Řádky, kde chybí x nebo y, se nepočítají, hodnoty bez jediného výskytu nejsou v tabulce. """
+    (x_codes, x_labels), (y_codes, y_labels) = (v if isinstance(v, tuple) else coded(v) for v in (x, y))
+    valid = (x_codes >= 0) & (y_codes >= 0)
+    if where is not None:
+        valid &= np.asarray(where, dtype=bool)
+    counts = np.bincount(x_codes[valid] * len(y_labels) + y_codes[valid], minlength=len(x_labels) * len(y_labels))
+    table = pd.DataFrame(counts.reshape(len(x_labels), len(y_labels)), index=x_labels, columns=y_labels)
+    return table.loc[table.sum(axis=1) > 0, table.sum(axis=0) > 0]
+
+
+def chi2_test(table: pd.DataFrame) -> dict:
+    """ Chí-kvadrát test nezávislosti nad kontingenční tabulkou (scipy.stats.chi2_contingency) """
+    if table.shape[0] < 2 or table.shape[1] < 2:  # Jedna z proměnných je konstantní, test nemá smysl
+        return {"chi2": np.nan, "dof": 0, "pvalue": np.nan, "n": int(table.values.sum())}
+    chi2, pvalue, dof, _ = scipy.stats.chi2_contingency(table.values)
+    return {"chi2": chi2, "dof": int(dof), "pvalue": pvalue, "n": int(table.values.sum())}
+
+
+def adjust_pvalues(pvalues, method: str = "holm") -> np.ndarray:
+    """ Korekce p-hodnot pro mnohonásobné testování: "bonferroni", "holm" nebo "fdr_bh" (Benjamini-Hochberg).
+    Chybějící p-hodnoty (NaN) zůstávají NaN a nepočítají se do počtu testů. """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    adjusted = np.full(pvalues.shape, np.nan)
+    known = np.flatnonzero(~np.isnan(pvalues))
+    m = known.size
+    order = known[np.argsort(pvalues[known], kind='stable')]
+    p = pvalues[order]
+    if method == "bonferroni":
+        adj = p * m
+    elif method == "holm":
+        adj = np.maximum.accumulate(p * (m - np.arange(m)))
+    elif method == "fdr_bh":
+        adj = np.minimum.accumulate((p * m / np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        raise ValueError(f"Unknown correction method: {method}")
+    adjusted[order] = np.minimum(adj, 1)
+    return adjusted
+
+
+def variable(df: pd.DataFrame, spec):
+    """ Proměnná hypotézy: název sloupce nebo funkce(df) vracející pole (např. binarizovaný predikát) """
+    return spec(df) if callable(spec) else df[spec]
+
+
+def test_hypotheses(df: pd.DataFrame, hypotheses: dict, correction: str = "holm", alpha: float = 0.05) -> pd.DataFrame:
+    """ Chí-kvadrát testy více hypotéz najednou s korekcí p-hodnot.
+    hypotheses: název: (x, y) nebo (x, y, where) - x, y jsou sloupce nebo funkce(df), where je funkce(df) vracející masku řádků.
+    Stejné proměnné (podle názvu sloupce nebo funkce) se kódují jen jednou.
+    Vrací tabulku s hodnotami chi2, dof, pvalue, n, pvalue_adj a reject (zamítnutí nezávislosti na hladině alpha). """
+    encoded = {}
+
+    def codes(spec):
+        if spec not in encoded:
+            encoded[spec] = coded(variable(df, spec))
+        return encoded[spec]
+    results = []
+    for name, spec in hypotheses.items():
+        x, y = spec[0], spec[1]
+        where = spec[2](df) if len(spec) > 2 else None
+        results.append({"hypothesis": name, **chi2_test(contingency(codes(x), codes(y), where))})
+    results = pd.DataFrame(results, columns=["hypothesis", "chi2", "dof", "pvalue", "n"]).set_index("hypothesis")
+    results["pvalue_adj"] = adjust_pvalues(results["pvalue"], correction)
+    results["reject"] = results["pvalue_adj"] < alpha
+    return results
+
+
+def factor_sweep(df: pd.DataFrame, outcome, factors: list = None, max_levels: int = 50, exclude: list = (), **kwargs) -> pd.DataFrame:
+    """ Test nezávislosti každého faktoru na outcome (sloupec nebo funkce(df)), viz test_hypotheses.
+    factors: sloupce faktorů, implicitně všechny sloupce p* s nejvýše max_levels různými hodnotami
+    (identifikátory, časy a částky mají obvykle více hodnot, takže se netestují).
+    exclude: sloupce, které se netestují - u outcome zadaného funkcí sloupce, ze kterých je spočítaný
+    (jinak by se testovala závislost outcome na sobě samém). Výsledek je seřazený podle p-hodnoty. """
+    exclude = set(exclude) | ({outcome} if isinstance(outcome, str) else set())
+    if factors is None:
+        factors = [collum for collum in df.columns if re.fullmatch(r'p\d+[a-z]?', collum) and collum not in exclude
+                   and df[collum].nunique() <= max_levels]
+    else:
+        factors = [factor for factor in factors if factor not in exclude]
+    results = test_hypotheses(df, {factor: (factor, outcome) for factor in factors}, **kwargs)
+    return results.sort_values("pvalue", kind='stable')
+
+
+if __name__ == "__main__":
+    df = load_dataframe("accidents.pkl.gz")
+    # Hypotéza ze stat.ipynb: pokud byl viník pod silným vlivem alkoholu, došlo častěji k těžkým zdravotním následkům
+    # (bez záznamů, kdy vliv alkoholu není znám nebo byl viník pod vlivem drog)
+    victims = lambda df: (df['p13a'] + df['p13b']) > 0
+    print(test_hypotheses(df, {"alkohol": (lambda df: df['p11'] >= 7, victims, lambda df: ~df['p11'].isin([-1, 4, 5]))}))
+    # Všechny faktory proti vzniku obětí (bez počtů obětí, ze kterých je outcome spočítaný)
+    print(factor_sweep(df, victims, exclude=['p13a', 'p13b', 'p13c']).to_string())
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3.8
+# coding=utf-8
+####################################################
+# Author: Vojtěch Ulej (xulejv00)                  #
+# Created: 18.10. 2026                             #
+# Description: Shared loader of accidents.pkl.gz   #
+####################################################
+# Scripts in 2ndPart and 3rdPart import this module by adding the repository root
+# to sys.path, so it has to stay in the root next to these directories.
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Dictionary of column names and datatypes
+column_types = {
+    "p1": 'int64',
+    "p36": 'int8',
+    # "p37": 'int32',
+    "p2a": 'datetime64[ns]',
+    "weekday(p2a)": 'int8',
+    "p2b": 'int16',
+    "p6": 'int8',
+    "p7": 'int8',
+    "p8": 'int8',
+    "p9": 'int8',
+    "p10": 'int8',
+    "p11": 'int8',
+    "p12": 'int16',
+    "p13a": 'int16',
+    "p13b": 'int16',
+    "p13c": 'int16',
+    "p14": 'int64',
+    "p15": 'int8',
+    "p16": 'int8',
+    "p17": 'int8',
+    "p18": 'int8',
+    "p19": 'int8',
+    "p20": 'int8',
+    "p21": 'int8',
+    "p22": 'int8',
+    "p23": 'int8',
+    "p24": 'int8',
+    "p27": 'int8',
+    "p28": 'int8',
+    "p34": 'int8',
+    "p35": 'int8',
+    "p39": 'int8',
+    "p44": 'int8',
+    "p45a": 'int8',
+    "p47": 'int8',
+    "p48a": 'int8',
+    "p49": 'int8',
+    "p50a": 'int8',
+    "p50b": 'int8',
+    "p51": 'int8',
+    "p52": 'int8',
+    "p53": 'int64',
+    "p55a": 'int8',
+    "p57": 'int8',
+    "p58": 'int8',
+    "a": 'str',
+    "b": 'str',
+    "d": 'float64',
+    "e": 'float64',
+    "f": 'float64',
+    "g": 'float64',
+    "h": 'str',
+    "i": 'str',
+    "j": 'str',
+    "k": 'str',
+    "l": 'str',
+    "n": 'str',
+    "o": 'str',
+    "p": 'str',
+    "q": 'str',
+    "r": 'str',
+    "s": 'str',
+    "t": 'str',
+    "p5a": 'int8',
+    "region": 'category'  # 14 regions, codes instead of strings
+}
+# Collums with numbers and missing values, missing values are coerced to NA
+nullable_collums = ['p37', 'n', 'r', 's']
+# Collums with strings, empty string means missing value
+str_collums = [collum for collum, dtype in column_types.items() if dtype == 'str' and collum not in nullable_collums]
+
+# Version of typed cache, has to be changed when column_types or type_dataframe is changed
+# (2: empty strings are replaced only in string collums, 3: sha256 of every collum in schema)
+cache_version = 3
+
+
+# Converts DataFrame loaded from accidents.pkl.gz to correct datatypes
+def type_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.astype({collum: dtype for collum, dtype in column_types.items() if dtype != 'str'})
+    for collum in str_collums:  # Only string collums can contain empty strings (numbers are parsed already)
+        values = df[collum].to_numpy(dtype=object)
+        empty = values == ''
+        if empty.any():
+            values = values.copy()
+            values[empty] = pd.NA
+        df[collum] = pd.Series(values, index=df.index).astype('str')
+    for collum in nullable_collums:
+        df[collum] = pd.to_numeric(df[collum], errors='coerce').astype('Int32')
+    df.rename(columns={'p2a': 'date'}, inplace=True)
+    return df
+
+
+# Returns sha256 of file (or of several files one after another)
+def file_hash(*filenames: str) -> str:
+    checksum = hashlib.sha256()
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1048576), b''):
+                checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+# Estimates memory usage of DataFrame (bytes) as memory_usage(deep=True) but without walking every string:
+# sizes of other collums are given by dtype, size of string collums is estimated from sample of rows
+def memory_usage(df: pd.DataFrame, sample: int = 1000) -> int:
+    usage = df.memory_usage(deep=False)
+    strings = [collum for collum in df.columns if not isinstance(df[collum].dtype, pd.CategoricalDtype)
+               and (df[collum].dtype == object or pd.api.types.is_string_dtype(df[collum].dtype))]
+    if strings and len(df) > sample:
+        rows = df[strings].iloc[::len(df) // sample]
+        usage[strings] = rows.memory_usage(index=False, deep=True)[strings] * (len(df) / len(rows))
+    elif strings:
+        usage[strings] = df[strings].memory_usage(index=False, deep=True)[strings]
+    return int(usage.sum())
+
+
+# Saves typed DataFrame to directory, every collum is stored in uncompressed .npy file(s):
+# categories and strings as codes + table of unique values, nullable integers as values + mask of NA
+# key identifies source of data, metadata (dictionary) is stored to schema
+# Schema contains sha256 of every collum, so users of cache can find out which collums were changed
+def save_dataframe(dirname: str, df: pd.DataFrame, key: str, metadata: dict = None):
+    tmp_dirname = dirname + '.tmp'
+    if os.path.exists(tmp_dirname):
+        shutil.rmtree(tmp_dirname)
+    os.makedirs(tmp_dirname)
+    schema = {"version": cache_version, "key": key, "rows": len(df), "collums": [], **(metadata or {})}
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        np.save(f"{tmp_dirname}/index.npy", df.index.to_numpy())
+        schema["index"] = "index.npy"
+    for i, name in enumerate(df.columns):
+        coll = df[name]
+        entry = {"name": name, "dtype": str(coll.dtype)}
+        if isinstance(coll.dtype, pd.CategoricalDtype):
+            np.save(f"{tmp_dirname}/{i}.codes.npy", coll.cat.codes.to_numpy())
+            np.save(f"{tmp_dirname}/{i}.categories.npy", coll.cat.categories.to_numpy(), allow_pickle=True)
+            entry.update(kind="category", ordered=bool(coll.cat.ordered))
+        elif coll.dtype == object or pd.api.types.is_string_dtype(coll.dtype):
+            codes, categories = pd.factorize(coll)  # Missing values have code -1
+            np.save(f"{tmp_dirname}/{i}.codes.npy", codes.astype(np.int32))
+            np.save(f"{tmp_dirname}/{i}.categories.npy", np.asarray(categories, dtype=object), allow_pickle=True)
+            entry.update(kind="string")
+        elif isinstance(coll.dtype, pd.api.extensions.ExtensionDtype):
+            np.save(f"{tmp_dirname}/{i}.npy", coll.to_numpy(dtype=coll.dtype.numpy_dtype, na_value=0))
+            np.save(f"{tmp_dirname}/{i}.mask.npy", coll.isna().to_numpy())
+            entry.update(kind="masked")
+        else:
+            np.save(f"{tmp_dirname}/{i}.npy", np.ascontiguousarray(coll.to_numpy()))
+            entry.update(kind="numpy")
+        files = {"category": ("codes.npy", "categories.npy"), "string": ("codes.npy", "categories.npy"), "masked": ("npy", "mask.npy"), "numpy": ("npy",)}
+        entry["sha256"] = file_hash(*(f"{tmp_dirname}/{i}.{file}" for file in files[entry["kind"]]))
+        schema["collums"].append(entry)
+    with open(tmp_dirname + '/schema.json', 'w') as f:
+        json.dump(schema, f, indent=1)
+    if os.path.exists(dirname):  # Replace old cache
+        shutil.rmtree(dirname)
+    os.replace(tmp_dirname, dirname)
+
+
+# Returns schema of DataFrame saved by save_dataframe, None if there is no cache or it is saved in other version of cache format
+def load_schema(dirname: str):
+    try:
+        with open(dirname + '/schema.json', 'r') as f:
+            schema = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return schema if schema.get("version") == cache_version else None
+
+
+# Loads DataFrame saved by save_dataframe, returns None if there is no cache or it was saved for other key or version
+# If collums (list of names) is given, only these collums are loaded
+# mmap_mode (see np.load) allows to share loaded collums between processes through page cache instead of reading them,
+# only numeric collums stay memory-mapped, category (codes), string and masked collums are still materialized in memory
+# Metadata from schema are stored in df.attrs
+def load_saved_dataframe(dirname: str, key: str, collums: list = None, mmap_mode: str = None):
+    schema = load_schema(dirname)
+    if schema is None or schema.get("key") != key:
+        return None
+    loaded = {}
+    for i, entry in enumerate(schema["collums"]):
+        if collums is not None and entry["name"] not in collums:
+            continue
+        if entry["kind"] == "category":
+            categories = np.load(f"{dirname}/{i}.categories.npy", allow_pickle=True)
+            loaded[entry["name"]] = pd.Categorical.from_codes(np.load(f"{dirname}/{i}.codes.npy", mmap_mode=mmap_mode), categories, ordered=entry["ordered"])
+        elif entry["kind"] == "string":
+            codes = np.load(f"{dirname}/{i}.codes.npy", mmap_mode=mmap_mode)
+            values = np.append(np.load(f"{dirname}/{i}.categories.npy", allow_pickle=True), None)[codes]  # Code -1 is the last one (None)
+            loaded[entry["name"]] = pd.array(values, dtype=entry["dtype"])
+        elif entry["kind"] == "masked":
+            values = pd.array(np.load(f"{dirname}/{i}.npy"), dtype=entry["dtype"])
+            values[np.load(f"{dirname}/{i}.mask.npy")] = pd.NA
+            loaded[entry["name"]] = values
+        else:
+            loaded[entry["name"]] = np.load(f"{dirname}/{i}.npy", mmap_mode=mmap_mode)
+    index = np.load(f"{dirname}/{schema['index']}", allow_pickle=True) if "index" in schema else None
+    df = pd.DataFrame(loaded, index=index, columns=[entry["name"] for entry in schema["collums"] if entry["name"] in loaded], copy=False)  # Memory-mapped arrays aren't copied
+    df.attrs.update({k: v for k, v in schema.items() if k not in ("version", "key", "rows", "collums", "index")})
+    return df
+
+
+# Loads accidents.pkl.gz, converts it to correct datatypes and saves it to cache directory dirname (if it is given and possible)
+def build_cache(filename: str, dirname: str = None, key: str = None) -> pd.DataFrame:
+    df = pd.read_pickle(filename)
+    source_memory = memory_usage(df)
+    df = type_dataframe(df)
+    df.attrs["source_memory"] = source_memory
+    if dirname:
+        try:
+            save_dataframe(dirname, df, key, {"source_memory": source_memory})
+        except OSError:  # Read only directory, data are just not cached
+            pass
+    return df
+
+
+# Returns schema of typed cache of accidents.pkl.gz (creates the cache if it doesn't exist or file was changed),
+# None if cache can't be created. Collums of cache can be loaded by load_saved_dataframe(filename + '.cache', schema["key"], ...)
+def cache_schema(filename: str):
+    key = file_hash(filename)
+    schema = load_schema(filename + '.cache')
+    if schema is None or schema.get("key") != key:
+        build_cache(filename, filename + '.cache', key)
+        schema = load_schema(filename + '.cache')
+    return schema if schema is not None and schema.get("key") == key else None
+
+
+# Loads accidents.pkl.gz with correct datatypes (type_dataframe)
+# Typed DataFrame is cached in directory next to the file (<filename>.cache), cache is used while sha256 of file matches
+# If collums (list of names) is given, only these collums are returned
+# df.attrs["source_memory"] is memory usage of DataFrame before conversion (bytes)
+def load_dataframe(filename: str, cache: bool = True, collums: list = None) -> pd.DataFrame:
+    if not cache:
+        df = build_cache(filename)
+    else:
+        key = file_hash(filename)
+        df = load_saved_dataframe(filename + '.cache', key, collums)
+        if df is None:
+            df = build_cache(filename, filename + '.cache', key)
+    return df if collums is None else df[[collum for collum in df.columns if collum in collums]]
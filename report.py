@@ -0,0 +1,138 @@
+#!/usr/bin/env python3.8
+# coding=utf-8
+####################################################
+# Author: Vojtěch Ulej (xulejv00)                  #
+# Created: 18.10. 2026                             #
+# Description: Builds all figures of the report    #
+####################################################
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import importlib
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+root = os.path.dirname(os.path.abspath(__file__))
+for part in ("1stPart", "2ndPart", "3rdPart", ""):
+    sys.path.insert(0, os.path.join(root, part))
+import accidents
+
+
+# Data for plot_stat (same format as result of DataDownloader.get_list) made from typed DataFrame
+# Rows without region (or with region which isn't in download.region_names) are dropped, they have no code
+def stat_data(df):
+    import download
+    regions = np.array([download.region_names.index(reg) if reg in download.region_names else -1 for reg in df["region"].cat.categories] + [-1])
+    codes = regions[df["region"].cat.codes.to_numpy()]
+    known = codes >= 0
+    return [download.coll_names[0], download.coll_names[4]], [codes[known], df["date"].to_numpy()[known]]
+
+
+def geo_data(df):
+    import geo
+    return geo.make_geo(df)
+
+
+# Figures of report: file name: (module, function, collums of typed DataFrame, function which prepares data (None = DataFrame))
+# Function is called as function(data, path to figure)
+figures = {
+    "stat.png": ("get_stat", "plot_stat", ["region", "date"], stat_data),
+    "01_nasledky.png": ("analysis", "plot_conseq", ["region", "p13a", "p13b", "p13c"], None),
+    "02_priciny.png": ("analysis", "plot_damage", ["region", "p53", "p12"], None),
+    "03_stav.png": ("analysis", "plot_surface", ["region", "date", "p16"], None),
+    "geo1.png": ("geo", "plot_geo", ["region", "date", "p5a", "d", "e", "f", "g"], geo_data),
+    "geo2.png": ("geo", "plot_cluster", ["region", "date", "d", "e", "f", "g"], geo_data),
+    "fig.png": ("doc", "plot_cars", ["date", "p44", "p45a"], None),
+}
+# Source files which figures depend on (besides file of their module)
+common_sources = ["accidents.py", "report.py"]
+module_sources = {"get_stat": ["1stPart/get_stat.py", "1stPart/download.py"], "analysis": ["2ndPart/analysis.py"],
+                  "geo": ["3rdPart/geo.py"], "doc": ["3rdPart/doc.py"]}
+
+
+# Fingerprint of figure: sha256 of collums it uses (from cache schema) and of source code which draws it
+# Figure has to be drawn again only if its fingerprint was changed
+def fingerprint(figure, schema):
+    module, function, collums, _ = figures[figure]
+    checksum = hashlib.sha256(f"{figure}:{module}.{function}:{accidents.cache_version}".encode())
+    checksums = {entry["name"]: entry["sha256"] for entry in schema["collums"]}
+    for collum in collums:
+        checksum.update(f"{collum}:{checksums.get(collum)}".encode())
+    checksum.update(accidents.file_hash(*(os.path.join(root, f) for f in common_sources + module_sources[module])).encode())
+    return checksum.hexdigest()
+
+
+# Draws one figure in worker process, collums are memory-mapped from cache of data (shared by all workers through page cache)
+# Returns None or text of error
+def render(figure, dirname, key, output):
+    import matplotlib
+    matplotlib.use("Agg")  # Without window, figures are only saved
+    import matplotlib.pyplot as plt
+    module, function, collums, prepare = figures[figure]
+    try:
+        df = accidents.load_saved_dataframe(dirname, key, collums, mmap_mode='r')
+        if df is None:
+            return "cache of data was changed"
+        getattr(importlib.import_module(module), function)(prepare(df) if prepare else df, os.path.join(output, figure))
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        plt.close('all')
+    return None
+
+
+# Draws figures whose data or code were changed (or all if force), data are loaded and typed only once (accidents.cache_schema)
+# Returns dictionary figure: None (drawn) / "skipped" / text of error
+def build_report(filename, output="report", workers=4, selected=None, force=False):
+    schema = accidents.cache_schema(filename)
+    if schema is None:
+        raise OSError(f"Can't create cache of {filename}")
+    os.makedirs(output, exist_ok=True)
+    manifest_filename = os.path.join(output, "report.json")
+    try:
+        with open(manifest_filename, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    results = {}
+    todo = {}
+    for figure in selected or figures:
+        if figure not in figures:
+            raise ValueError(f"Unknown figure {figure}, use one of {', '.join(figures)}")
+        todo[figure] = fingerprint(figure, schema)
+        if not force and manifest.get(figure) == todo[figure] and os.path.exists(os.path.join(output, figure)):
+            results[figure] = "skipped"
+            del todo[figure]
+    if todo:
+        with ProcessPoolExecutor(max(1, min(workers, len(todo)))) as executor:
+            futures = {figure: executor.submit(render, figure, filename + '.cache', schema["key"], output) for figure in todo}
+            for figure, future in futures.items():
+                results[figure] = future.result()
+                if results[figure] is None:
+                    manifest[figure] = todo[figure]
+                else:
+                    manifest.pop(figure, None)
+        with open(manifest_filename, 'w') as f:
+            json.dump(manifest, f, indent=1)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Draw figures of report, only figures whose data or code were changed are drawn again.')
+    parser.add_argument('--data', type=str, default="accidents.pkl.gz")
+    parser.add_argument('--output', type=str, default="report")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--force', action='store_true', help="Draw all figures")
+    parser.add_argument('figures', nargs='*', help=f"Figures to draw ({', '.join(figures)}), all by default")
+    args = parser.parse_args()
+    failed = False
+    for figure, result in build_report(args.data, args.output, args.workers, args.figures, args.force).items():
+        print(f"{figure}: {'drawn' if result is None else result if result == 'skipped' else 'failed'}")
+        if result not in (None, "skipped"):
+            print(result, file=sys.stderr)
+            failed = True
+    sys.exit(1 if failed else 0)